@@ -15,12 +15,18 @@ from flask import Flask, render_template, jsonify, request, send_from_directory,
 import json
 import os
 import shutil
-from datetime import datetime
+from datetime import datetime, timezone
 import pandas as pd
 import hashlib
 from pathlib import Path
-import re
-from urllib.parse import urlparse
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict
+
+import archive_store
+import message_format
 
 app = Flask(__name__)
 
@@ -42,6 +48,11 @@ TOPIC_NAMES = {
 }
 
 OUTPUT_DIR = "output" # Base directory for archives
+# Memory budget of the prepared-archive cache (override with GRAMSCRAP_CACHE_MB)
+ARCHIVE_CACHE_MAX_BYTES = int(os.environ.get('GRAMSCRAP_CACHE_MB', 512)) * 1024 * 1024
+ARCHIVE_CACHE_SIZE_FACTOR = 3 # Estimated memory of a prepared archive, as a multiple of its file size
+PAGE_SIZE = 100 # Messages per page of the chat view and default page size of the paginated API
+MAX_PAGE_SIZE = 1000
 
 def get_archive_display_name(group_id_str, topic_id_str=None):
     """Returns a display name for a group or a specific topic within a group."""
@@ -63,105 +74,357 @@ def hash_color(text):
 
 app.jinja_env.filters['hash_color'] = hash_color
 
-def convert_links_to_html(text):
-    if not text:
-        return ""
-    # Markdown links [label](url)
-    text = re.sub(r'\[([^\]]+?)\]\((https?://[^\s)]+)\)', 
-                  r'<a href="\2" target="_blank" class="chat-link">\1</a>', text)
-    # Naked URLs, but not if already in an href attribute
-    text = re.sub(r'(?<!href=["a-zA-Z0-9])(https?://(?:[\w\-./?=&%:]|(?:%[\da-fA-F]{2}))+)', 
-                  r'<a href="\1" target="_blank" class="chat-link">\1</a>', text)
-    return text
-
-def format_telegram_style(text):
-    if not text:
-        return ""
-    text = str(text) # Ensure text is a string
-    text = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', text) # Bold
-    text = re.sub(r'__(.+?)__', r'<em>\1</em>', text) # Italics (double underscore)
-    text = re.sub(r'(?<!_)_(?!_)(.+?)(?<!_)_(?!_)', r'<em>\1</em>', text) # Single underscore italics, avoid __
-    text = re.sub(r'~~(.+?)~~', r'<del>\1</del>', text) # Strikethrough
-    text = re.sub(r'```(?:[a-zA-Z_0-9\-]*\n)?([\s\S]+?)```', r'<pre><code>\1</code></pre>', text, flags=re.MULTILINE) # Code blocks
-    text = re.sub(r'`(.+?)`', r'<code>\1</code>', text) # Inline code
-    # Links are handled by convert_links_to_html, called separately
-    text = text.replace('\n', '<br>') # Newlines to <br>
-    return text
-
-def load_messages(group_id, topic_id=None):
+def get_archive_dir(group_id, topic_id=None):
+    """Returns the directory of a group's complete archive or of one of its topics."""
     group_id_str = str(group_id).replace("group_","")
-    
     if topic_id:
         topic_id_str = str(topic_id).replace("topic_","")
-        archive_path = Path(OUTPUT_DIR) / f"group_{group_id_str}" / f"topic_{topic_id_str}" / "archive.json"
+        return Path(OUTPUT_DIR) / f"group_{group_id_str}" / f"topic_{topic_id_str}"
+    return Path(OUTPUT_DIR) / f"group_{group_id_str}" / "complete_archive"
+
+def author_display_name(msg):
+    """Author string used by the dropdown filter and the ?author= API parameter."""
+    return f"{msg.get('sender_first_name', '')} {msg.get('sender_last_name', '')}".strip() + \
+           (f" (@{msg.get('sender_username')})" if msg.get('sender_username') else "")
+
+def prepare_message(msg):
+    """Adds the parsed date ('date_dt', plus 'date_str' for unusable dates) and 'text_html' to a record."""
+    date_val = msg.get('date')
+    if date_val:
+        try:
+            msg['date_dt'] = datetime.fromisoformat(str(date_val).replace('Z', '+00:00'))
+        except (ValueError, TypeError):
+            msg['date_dt'] = datetime.now() 
+            msg['date_str'] = str(date_val) # Keep original problematic string for display
     else:
-        archive_path = Path(OUTPUT_DIR) / f"group_{group_id_str}" / "complete_archive" / "archive.json"
-    
-    if not archive_path.exists():
-        raise FileNotFoundError(f"Archive file not found: {archive_path}")
-
-    with open(archive_path, 'r', encoding='utf-8') as f:
-        messages = json.load(f)
-    
-    for msg in messages:
-        date_val = msg.get('date')
-        if date_val:
-            try:
-                msg['date_dt'] = datetime.fromisoformat(str(date_val).replace('Z', '+00:00'))
-            except (ValueError, TypeError):
-                msg['date_dt'] = datetime.now() 
-                msg['date_str'] = str(date_val) # Keep original problematic string for display
-        else:
-            msg['date_dt'] = datetime.now()
-            msg['date_str'] = "No Date Available"
-
-        msg_text = msg.get('text', '')
-        # IMPORTANT: Apply link conversion BEFORE other formatting to avoid breaking link structure
-        html_text = convert_links_to_html(msg_text) 
-        msg['text_html'] = format_telegram_style(html_text) 
+        msg['date_dt'] = datetime.now()
+        msg['date_str'] = "No Date Available"
+
+    msg['text_html'] = message_format.record_text_html(msg) # Stored by the scraper; rendered here for older records
+    return msg
+
+def message_sort_key(msg):
+    """Order of messages in the viewer and of the API's keyset pagination: (date, message ID)."""
+    return msg['date_dt'], msg['id']
+
+def encode_cursor(msg):
+    """Opaque pagination cursor of a message, '<ISO date>_<message ID>'."""
+    return f"{msg['date_dt'].isoformat()}_{msg['id']}"
+
+def decode_cursor(cursor):
+    """Returns the (date, message ID) key of a cursor made by encode_cursor(). Raises ValueError if invalid."""
+    date_part, _, id_part = cursor.rpartition('_')
+    return datetime.fromisoformat(date_part), int(id_part)
+
+def match_timezone(value, reference):
+    """Makes a datetime comparable with reference: naive values are read as UTC, and vice versa."""
+    if value.tzinfo is None and reference.tzinfo is not None:
+        return value.replace(tzinfo=timezone.utc)
+    if value.tzinfo is not None and reference.tzinfo is None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def paginate_messages(messages, limit=PAGE_SIZE, after=None, before=None, date_from=None, date_to=None):
+    """Returns one keyset page of messages (sorted by message_sort_key()) as a dict.
+
+    The page holds up to `limit` messages following the `after` cursor, or preceding the
+    `before` cursor ('end' for the last page), or from the start of the range otherwise.
+    date_from (inclusive) and date_to (exclusive) bound the range. Cursors are only set
+    when more messages exist in that direction. Positions are found by bisection, so a
+    page costs O(log n + limit) whatever the archive size.
+    """
+    if not messages:
+        return {'messages': [], 'total': 0, 'prev_cursor': None, 'next_cursor': None}
+    reference = messages[0]['date_dt']
+
+    def date_bound(value):
+        return match_timezone(datetime.fromisoformat(value.replace('Z', '+00:00')), reference)
+
+    def cursor_key(cursor):
+        cursor_date, msg_id = decode_cursor(cursor)
+        return match_timezone(cursor_date, reference), msg_id
+
+    low = bisect_left(messages, date_bound(date_from), key=lambda m: m['date_dt']) if date_from else 0
+    high = bisect_left(messages, date_bound(date_to), key=lambda m: m['date_dt']) if date_to else len(messages)
+    high = max(low, high)
+    if before:
+        end = high if before == 'end' else min(high, max(low, bisect_left(messages, cursor_key(before), key=message_sort_key)))
+        start = max(low, end - limit)
+    else:
+        start = max(low, min(high, bisect_right(messages, cursor_key(after), key=message_sort_key))) if after else low
+        end = min(high, start + limit)
+    page = messages[start:end]
+    return {
+        'messages': page,
+        'total': high - low,
+        'prev_cursor': encode_cursor(page[0]) if page and start > low else None,
+        'next_cursor': encode_cursor(page[-1]) if page and end < high else None
+    }
 
-    messages.sort(key=lambda x: x['date_dt'])
-    return messages
+class AuthorIndex:
+    """Index of an archive's authors: sender_id -> display name, message count and message positions.
+
+    Positions are indexes into the archive's prepared message list (sorted by
+    message_sort_key()), kept per sender as a compact array. The display name is the
+    one of the sender's latest message. Building it is one pass over the archive;
+    after that, appended messages are added one at a time and filtering by author
+    costs O(matches).
+    """
+
+    def __init__(self, messages=()):
+        self.authors = {} # sender_id -> {'name': display name, 'positions': array of positions}
+        for position, msg in enumerate(messages):
+            self.add(position, msg)
+
+    def add(self, position, msg):
+        """Indexes the message at position, which follows every indexed position."""
+        sender_id = msg.get('sender_id')
+        if not sender_id:
+            return
+        author = self.authors.get(sender_id)
+        if author is None:
+            author = self.authors[sender_id] = {'name': '', 'positions': array('L')}
+        author['positions'].append(position)
+        author['name'] = author_display_name(msg)
+
+    def update(self, position, msg):
+        """Takes an edited message at an already indexed position into account."""
+        author = self.authors.get(msg.get('sender_id'))
+        if author is not None and author['positions'][-1] == position:
+            author['name'] = author_display_name(msg)
+
+    def sender_ids_named(self, name):
+        """Returns the sender IDs whose display name is name."""
+        return [sender_id for sender_id, author in list(self.authors.items()) if author['name'] == name]
+
+    def messages(self, messages, sender_ids):
+        """Returns the messages of the given senders, in the order of messages."""
+        position_lists = [self.authors[sender_id]['positions'] for sender_id in sender_ids if sender_id in self.authors]
+        if len(position_lists) == 1:
+            return [messages[position] for position in position_lists[0]]
+        return [messages[position] for position in heapq.merge(*position_lists)]
+
+    def facets(self, counts=None):
+        """Returns [{'sender_id', 'name', 'count'}] sorted by name, with counts from
+        the index or, if given, from a {sender_id: count} mapping."""
+        facets = [{'sender_id': sender_id, 'name': author['name'],
+                   'count': len(author['positions']) if counts is None else counts[sender_id]}
+                  for sender_id, author in list(self.authors.items())
+                  if counts is None or counts.get(sender_id)]
+        facets.sort(key=lambda facet: (facet['name'].casefold(), facet['sender_id']))
+        return facets
+
+class PreparedArchiveCache:
+    """Process-wide LRU cache of prepared archives (parsed, formatted and sorted by date).
+
+    Entries are keyed by archive file path and validated against its mtime and size.
+    When the scraper has only appended to archive.jsonl, just the new lines are read
+    and applied (new messages after the last one, or edits that keep their date);
+    anything else, such as a compacted or rewritten file, prepares the archive again.
+    Least recently used archives are evicted once the estimated memory use exceeds
+    max_bytes; an archive larger than the whole budget is not cached.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict() # path -> entry dict (see _load())
+        self._lock = threading.Lock()
+
+    def get(self, archive_path):
+        stat = archive_path.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+        key = str(archive_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry['signature'] == signature:
+                    self._entries.move_to_end(key)
+                    return entry['prepared']
+                if self._apply_appended(entry, archive_path, stat):
+                    self._entries.move_to_end(key)
+                    self._evict()
+                    return entry['prepared']
+
+        entry = self._load(archive_path, stat)
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self.total_bytes -= old_entry['bytes']
+            if entry['bytes'] <= self.max_bytes:
+                self._entries[key] = entry
+                self.total_bytes += entry['bytes']
+                self._evict()
+        return entry['prepared']
+
+    def _load(self, archive_path, stat):
+        messages = [prepare_message(msg) for msg in archive_store.load_archive(archive_path.parent)]
+        messages.sort(key=message_sort_key)
+        prepared = {'messages': messages, 'by_id': {msg['id']: msg for msg in messages},
+                    'authors': AuthorIndex(messages)}
+        # Appended lines can only be picked up from a JSONL file that ended on a complete line
+        offset = None
+        if archive_path.name == archive_store.ARCHIVE_JSONL and stat.st_size:
+            with open(archive_path, 'rb') as f:
+                f.seek(stat.st_size - 1)
+                if f.read(1) == b'\n':
+                    offset = stat.st_size
+        return {'signature': (stat.st_mtime_ns, stat.st_size), 'prepared': prepared,
+                'bytes': stat.st_size * ARCHIVE_CACHE_SIZE_FACTOR, 'inode': stat.st_ino, 'offset': offset}
+
+    def _apply_appended(self, entry, archive_path, stat):
+        """Applies the lines appended since the entry was loaded. Returns False if the archive must be prepared again."""
+        if entry['offset'] is None or stat.st_ino != entry['inode'] or stat.st_size < entry['offset']:
+            return False
+        records, offset = archive_store.read_appended_records(archive_path.parent, entry['offset'])
+        new_messages = [prepare_message(record) for record in records]
+
+        prepared = entry['prepared']
+        messages, by_id, authors = prepared['messages'], prepared['by_id'], prepared['authors']
+        # Check everything first, so a fallback never leaves the entry half updated
+        last_key = message_sort_key(messages[-1]) if messages else None
+        appended = {}
+        for msg in new_messages:
+            known = by_id.get(msg['id']) or appended.get(msg['id'])
+            if known is not None:
+                if message_sort_key(known) != message_sort_key(msg):
+                    return False
+            elif last_key is not None and message_sort_key(msg) <= last_key:
+                return False
+            else:
+                last_key = message_sort_key(msg)
+                appended[msg['id']] = msg
+
+        for msg in new_messages:
+            known = by_id.get(msg['id'])
+            if known is None:
+                messages.append(msg)
+                authors.add(len(messages) - 1, msg)
+            else:
+                position = bisect_left(messages, message_sort_key(known), key=message_sort_key)
+                messages[position] = msg
+                authors.update(position, msg)
+            by_id[msg['id']] = msg
+
+        added_bytes = (offset - entry['offset']) * ARCHIVE_CACHE_SIZE_FACTOR
+        entry['bytes'] += added_bytes
+        self.total_bytes += added_bytes
+        entry['offset'] = offset
+        entry['signature'] = (stat.st_mtime_ns, stat.st_size)
+        return True
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted['bytes']
+
+archive_cache = PreparedArchiveCache(ARCHIVE_CACHE_MAX_BYTES)
+
+def load_prepared(group_id, topic_id=None):
+    """Returns the prepared archive from archive_cache: {'messages', 'by_id', 'authors'}. Callers must not modify it."""
+    archive_dir = get_archive_dir(group_id, topic_id)
+    archive_path = archive_store.archive_file(archive_dir)
+    if archive_path is None:
+        raise FileNotFoundError(f"Archive file not found in: {archive_dir}")
+    return archive_cache.get(archive_path)
+
+def load_messages(group_id, topic_id=None, author=None, search=None, sender_id=None):
+    """Returns the prepared messages of an archive, optionally filtered by author and text, sorted by (date, ID).
+
+    The author is given as a sender_id or as a display name (see AuthorIndex). The
+    messages come from archive_cache and are shared between requests, so callers
+    must not modify them. Author filters are answered from the author index. A text
+    search uses the archive.sqlite FTS5 index if there is one; otherwise the
+    messages are filtered here.
+    """
+    prepared = load_prepared(group_id, topic_id)
+    messages, authors = prepared['messages'], prepared['authors']
+
+    sender_ids = None
+    if sender_id:
+        sender_ids = [int(sender_id)]
+    elif author:
+        sender_ids = authors.sender_ids_named(author)
+
+    archive_dir = get_archive_dir(group_id, topic_id)
+    if search and archive_store.sqlite_exists(archive_dir):
+        db = archive_store.SqliteArchive(archive_dir, readonly=True)
+        try:
+            # The search text is matched as one FTS5 phrase, not parsed as query syntax
+            fts_query = '"' + search.replace('"', '""') + '"'
+            matches = db.query(sender_ids=sender_ids, search=fts_query)
+        finally:
+            db.close()
+        # Prepared versions of the matches; records the cache does not have yet are prepared here
+        by_id = prepared['by_id']
+        messages = [by_id.get(msg['id']) or prepare_message(msg) for msg in matches]
+        messages.sort(key=message_sort_key)
+        return messages
+
+    if sender_ids is not None:
+        messages = authors.messages(messages, sender_ids)
+    if search:
+        search_lower = search.lower()
+        messages = [msg for msg in messages if search_lower in (msg.get('text') or '').lower()]
+    return list(messages)
+
+def archive_item(group_id, topic_id=None, summary=None):
+    """Entry of the index page for a group's complete archive or one of its topics, with its catalog summary if known."""
+    item = {
+        'type': 'topic' if topic_id else 'group',
+        'id': f"{group_id}_{topic_id}" if topic_id else group_id, # Unique ID for routing
+        'name': get_archive_display_name(group_id, topic_id),
+        'group_id': group_id,
+        'topic_id': topic_id # None indicates the whole group archive
+    }
+    if summary:
+        item.update(summary)
+    return item
+
+def catalog_items(base_path):
+    """Index page entries read from the scraper's catalog, or None if it is missing or stale.
+
+    The catalog is stale when the group directories differ from the ones it was
+    written for (e.g. an archive copied in by hand); checking that takes a single
+    directory listing instead of a walk of every archive.
+    """
+    catalog = archive_store.load_catalog(base_path)
+    if catalog is None or catalog.get('groups') != archive_store.catalog_groups(base_path):
+        return None
+    items = []
+    for key, summary in catalog.get('archives', {}).items():
+        group_dir_name, _, archive_name = key.partition('/')
+        group_id = group_dir_name.replace('group_', '')
+        if archive_name == 'complete_archive':
+            items.append(archive_item(group_id, summary=summary))
+        elif archive_name.startswith('topic_'):
+            items.append(archive_item(group_id, archive_name.replace('topic_', ''), summary))
+    return items
 
 @app.route('/')
 def index():
-    # Scan the OUTPUT_DIR for available group archives and their topics
-    archived_items = []
+    # List the archives from the catalog written by the scraper; scan OUTPUT_DIR if there is no usable catalog
     base_path = Path(OUTPUT_DIR)
     if not base_path.exists():
         app.logger.warning(f"Output directory '{OUTPUT_DIR}' not found.")
         return render_template('index.html', archives=[], error_message=f"Output directory '{OUTPUT_DIR}' not found.")
 
-    for group_dir in sorted(base_path.iterdir()): # Sort group directories by name
-        if group_dir.is_dir() and group_dir.name.startswith('group_'):
-            group_id = group_dir.name.replace('group_', '')
-            group_display_name = get_archive_display_name(group_id)
-
-            # Check for complete_archive for the group
-            complete_archive_path = group_dir / "complete_archive" / "archive.json"
-            if complete_archive_path.exists():
-                archived_items.append({
-                    'type': 'group',
-                    'id': group_id,
-                    'name': group_display_name,
-                    'group_id': group_id,
-                    'topic_id': None # Indicates it's the whole group archive
-                })
-
-            # Check for topic archives within the group
-            for item_in_group_dir in sorted(group_dir.iterdir()): # Sort topic directories by name
-                if item_in_group_dir.is_dir() and item_in_group_dir.name.startswith('topic_'):
-                    topic_id = item_in_group_dir.name.replace('topic_', '')
-                    topic_archive_path = item_in_group_dir / "archive.json"
-                    if topic_archive_path.exists():
-                        topic_display_name = get_archive_display_name(group_id, topic_id)
-                        archived_items.append({
-                            'type': 'topic',
-                            'id': f"{group_id}_{topic_id}", # Unique ID for routing
-                            'name': topic_display_name,
-                            'group_id': group_id,
-                            'topic_id': topic_id
-                        })
+    archived_items = catalog_items(base_path)
+    if archived_items is None:
+        archived_items = []
+        for group_dir in sorted(base_path.iterdir()): # Sort group directories by name
+            if group_dir.is_dir() and group_dir.name.startswith('group_'):
+                group_id = group_dir.name.replace('group_', '')
+
+                # Check for complete_archive for the group
+                if archive_store.archive_exists(group_dir / "complete_archive"):
+                    archived_items.append(archive_item(group_id))
+
+                # Check for topic archives within the group
+                for item_in_group_dir in sorted(group_dir.iterdir()): # Sort topic directories by name
+                    if item_in_group_dir.is_dir() and item_in_group_dir.name.startswith('topic_'):
+                        if archive_store.archive_exists(item_in_group_dir):
+                            archived_items.append(archive_item(group_id, item_in_group_dir.name.replace('topic_', '')))
     
     # Sort all items by name for final display
     archived_items.sort(key=lambda x: x['name'])
@@ -171,20 +434,20 @@ def index():
 @app.route('/archive/group/<group_id_str>/topic/<topic_id_str>')
 def chat_view(group_id_str, topic_id_str=None):
     try:
-        messages_data = load_messages(group_id_str, topic_id_str)
-        
-        # Prepare authors list for dropdown filter
-        authors = sorted(list(set(
-            f"{msg.get('sender_first_name', '')} {msg.get('sender_last_name', '')}".strip() + 
-            (f" (@{msg.get('sender_username')})" if msg.get('sender_username') else "")
-            for msg in messages_data 
-            if msg.get('sender_id') # Ensure there is a sender
-        )))
+        prepared = load_prepared(group_id_str, topic_id_str)
+        messages_data = prepared['messages']
+        authors = prepared['authors'].facets() # Dropdown filter, with message counts
         
         display_name = get_archive_display_name(group_id_str, topic_id_str)
 
+        # Only the first page is rendered; the page fetches the others from /api/messages as you scroll
+        page = paginate_messages(messages_data, PAGE_SIZE)
         return render_template('chat.html', 
-                             messages=messages_data, 
+                             messages=page['messages'], 
+                             first_cursor=page['prev_cursor'],
+                             last_cursor=page['next_cursor'],
+                             total_messages=page['total'],
+                             page_size=PAGE_SIZE,
                              authors=authors, 
                              archive_display_name=display_name,
                              group_id=group_id_str,
@@ -201,41 +464,73 @@ def chat_view(group_id_str, topic_id_str=None):
 @app.route('/api/messages/group/<group_id_str>/topic/<topic_id_str>')
 def api_messages(group_id_str, topic_id_str=None):
     try:
-        messages_data = load_messages(group_id_str, topic_id_str)
-        author_filter_str = request.args.get('author')
-        
-        if author_filter_str:
-            # Normalize author filter string for comparison
-            # Example author_filter_str: "FirstName LastName (@username)" or "FirstName LastName"
-            # We need to match based on how authors are constructed for the dropdown
-            
-            filtered_messages = []
-            for msg in messages_data:
-                current_msg_author_str = f"{msg.get('sender_first_name', '')} {msg.get('sender_last_name', '')}".strip() + \
-                                         (f" (@{msg.get('sender_username')})" if msg.get('sender_username') else "")
-                if current_msg_author_str == author_filter_str:
-                    filtered_messages.append(msg)
-            messages_data = filtered_messages
+        # Author filter: ?sender_id=<ID> (as used by the dropdown), or ?author= with a display
+        # name, "FirstName LastName (@username)" or "FirstName LastName"
+        try:
+            messages_data = load_messages(group_id_str, topic_id_str,
+                                          author=request.args.get('author'),
+                                          search=request.args.get('q'),
+                                          sender_id=request.args.get('sender_id'))
+        except ValueError as e:
+            return jsonify({'error': f"Invalid sender_id: {e}"}), 400
+
+        # Keyset pagination: ?limit=, ?after=/?before=<cursor> (before=end for the last page),
+        # ?from=/?to= date bounds and ?render=html. Without them the full list is returned.
+        paginated = any(request.args.get(name) for name in ('limit', 'after', 'before', 'from', 'to', 'render'))
+        page = None
+        if paginated:
+            try:
+                limit = min(max(1, int(request.args.get('limit', PAGE_SIZE))), MAX_PAGE_SIZE)
+                page = paginate_messages(messages_data, limit, after=request.args.get('after'),
+                                         before=request.args.get('before'),
+                                         date_from=request.args.get('from'), date_to=request.args.get('to'))
+            except ValueError as e:
+                return jsonify({'error': f"Invalid pagination parameter: {e}"}), 400
+            messages_data = page['messages']
+            if request.args.get('render') == 'html':
+                page['html'] = render_template('_message_page.html', messages=messages_data,
+                                               group_id=group_id_str, topic_id=topic_id_str, output_dir=OUTPUT_DIR)
+                del page['messages']
+                return jsonify(page)
         
-        # Convert datetime objects to string for JSON serialization if they exist
+        # Copies with the date as a string; date_dt and date_str are not JSON serializable
+        # by default jsonify (and the cached messages must stay unchanged)
+        response_data = []
         for msg in messages_data:
+            msg_copy = {key: value for key, value in msg.items() if key not in ('date_dt', 'date_str')}
             if 'date_dt' in msg and isinstance(msg['date_dt'], datetime):
-                msg['date'] = msg['date_dt'].strftime('%Y-%m-%d %H:%M:%S')
+                msg_copy['date'] = msg['date_dt'].strftime('%Y-%m-%d %H:%M:%S')
             elif 'date_str' in msg: # If original date was problematic
-                msg['date'] = msg['date_str']
-
-        # Remove date_dt and date_str as they're not directly JSON serializable by default jsonify
-        for msg in messages_data:
-            msg.pop('date_dt', None)
-            msg.pop('date_str', None)
+                msg_copy['date'] = msg['date_str']
+            response_data.append(msg_copy)
 
-        return jsonify(messages_data)
+        if page is not None:
+            page['messages'] = response_data
+            return jsonify(page)
+        return jsonify(response_data)
     except FileNotFoundError as e:
         return jsonify({'error': f"Archive not found. {str(e)}"}), 404
     except Exception as e:
         app.logger.error(f"API error for group {group_id_str} topic {topic_id_str}: {e}", exc_info=True)
         return jsonify({'error': f"An unexpected error occurred: {str(e)}"}), 500
 
+@app.route('/api/authors/group/<group_id_str>')
+@app.route('/api/authors/group/<group_id_str>/topic/<topic_id_str>')
+def api_authors(group_id_str, topic_id_str=None):
+    """Author facets: [{sender_id, name, count}], counted over the ?q= search matches if given."""
+    try:
+        authors = load_prepared(group_id_str, topic_id_str)['authors']
+        search = request.args.get('q')
+        if not search:
+            return jsonify(authors.facets())
+        matches = load_messages(group_id_str, topic_id_str, search=search)
+        return jsonify(authors.facets(Counter(msg.get('sender_id') for msg in matches)))
+    except FileNotFoundError as e:
+        return jsonify({'error': f"Archive not found. {str(e)}"}), 404
+    except Exception as e:
+        app.logger.error(f"Authors API error for group {group_id_str} topic {topic_id_str}: {e}", exc_info=True)
+        return jsonify({'error': f"An unexpected error occurred: {str(e)}"}), 500
+
 # Endpoint for serving media files
 @app.route('/<string:output_dir_name>/group_<string:group_id_str>/topic_<string:topic_id_str>/media/<path:filename>')
 @app.route('/<string:output_dir_name>/group_<string:group_id_str>/complete_archive/media/<path:filename>')
@@ -258,6 +553,15 @@ def serve_media(output_dir_name, group_id_str, filename, topic_id_str=None):
         app.logger.error(f"Error serving media {filename} for group {group_id_str} topic {topic_id_str}: {e}", exc_info=True)
         return f"Error serving media: {str(e)}", 500
 
+# Endpoint for serving thumbnails and video posters (created by tgscrap.py --thumbnails)
+@app.route('/<string:output_dir_name>/group_<string:group_id_str>/topic_<string:topic_id_str>/thumbs/<path:filename>')
+@app.route('/<string:output_dir_name>/group_<string:group_id_str>/complete_archive/thumbs/<path:filename>')
+def serve_thumbnail(output_dir_name, group_id_str, filename, topic_id_str=None):
+    if output_dir_name != Path(OUTPUT_DIR).name:
+        return "Invalid base directory for media.", 400
+    # Thumbnails never change once written, so the browser may keep them
+    return send_from_directory(get_archive_dir(group_id_str, topic_id_str) / "thumbs", filename, max_age=7 * 24 * 3600)
+
 # Export functionality (simplified, might need adjustments for new structure)
 @app.route('/export/group/<group_id_str>')
 @app.route('/export/group/<group_id_str>/topic/<topic_id_str>')
@@ -293,14 +597,6 @@ def export_archive(group_id_str, topic_id_str=None):
         
         messages_data = load_messages(group_id_str, topic_id_str)
         
-        # For export, convert datetime objects to string representations
-        for msg in messages_data:
-            if 'date_dt' in msg and isinstance(msg['date_dt'], datetime):
-                msg['date_for_html'] = msg['date_dt'].strftime('%Y-%m-%d %H:%M:%S')
-            elif 'date_str' in msg:
-                 msg['date_for_html'] = msg['date_str']
-            else:
-                 msg['date_for_html'] = "N/A"
 
         # Generate statistics
         total_messages = len(messages_data)
@@ -313,16 +609,19 @@ def export_archive(group_id_str, topic_id_str=None):
         # Prepare data for embedding, ensuring datetime objects are removed
         messages_for_json_embedding = []
         for msg_orig in messages_data:
-            msg_copy = msg_orig.copy()
+            msg_copy = msg_orig.copy() # The cached messages must stay unchanged
+            # For export, convert datetime objects to string representations
+            if 'date_dt' in msg_copy and isinstance(msg_copy['date_dt'], datetime):
+                msg_copy['date_for_html'] = msg_copy['date_dt'].strftime('%Y-%m-%d %H:%M:%S')
+            elif 'date_str' in msg_copy:
+                msg_copy['date_for_html'] = msg_copy['date_str']
+            else:
+                msg_copy['date_for_html'] = "N/A"
             msg_copy.pop('date_dt', None)
             if 'date_str' in msg_copy and 'date' not in msg_copy: # Ensure 'date' field has the string date
                 msg_copy['date'] = msg_copy['date_str']
             msg_copy.pop('date_str', None)
-            # Ensure text_html is present for the export template
-            if 'text_html' not in msg_copy:
-                 html_text = convert_links_to_html(msg_copy.get('text', '')) 
-                 msg_copy['text_html'] = format_telegram_style(html_text)
-            messages_for_json_embedding.append(msg_copy)
+            messages_for_json_embedding.append(msg_copy) # text_html was prepared by load_messages()
             
         # This string will be directly embedded into a <script> tag.
         # It defines the messagesData variable for JavaScript.
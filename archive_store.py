@@ -0,0 +1,749 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Archive storage shared by the scraper (tgscrap.py) and the viewer (app.py).
+
+An archive directory holds:
+  * archive.jsonl   - one message record per line, append-only. A record may be
+                      appended again later with updated fields; the last line
+                      for a given message ID wins.
+  * checkpoint.json - small progress file rewritten atomically after each flush.
+  * archive.sqlite  - optional indexed copy of the records (SqliteArchive), kept
+                      in sync by the scraper and queried by the viewer.
+
+Archives written by older versions (archive.json, one indented JSON array) are
+still readable and are converted by migrate_json_archive().
+
+The output directory itself holds catalog.json, a summary of every archive below
+it (message count, date span, size, last update) that the scraper refreshes
+after each run, so the viewer can list archives without walking the tree.
+"""
+
+import heapq
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError: # Windows: catalog updates are not locked against other processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_JSONL = "archive.jsonl"
+ARCHIVE_JSON = "archive.json" # Legacy format
+CHECKPOINT_FILE = "checkpoint.json"
+ARCHIVE_SQLITE = "archive.sqlite"
+CATALOG_FILE = "catalog.json" # In the output directory, see update_catalog()
+CATALOG_VERSION = 1
+COMPACT_RUN_RECORDS = 50000 # Records sorted in memory at a time by compact_archive()
+
+# Columns of the SQLite messages table; the full record is also kept as JSON in 'record'
+SQLITE_COLUMNS = ['id', 'date', 'sender_id', 'sender_username', 'sender_first_name', 'sender_last_name',
+                  'text', 'has_media', 'media_filename', 'has_links', 'reply_to_message_id']
+
+def archive_exists(archive_dir):
+    """True if archive_dir contains an archive in either format."""
+    archive_dir = Path(archive_dir)
+    return (archive_dir / ARCHIVE_JSONL).exists() or (archive_dir / ARCHIVE_JSON).exists()
+
+def archive_file(archive_dir):
+    """Returns the path of the archive file in use (JSONL preferred), or None."""
+    archive_dir = Path(archive_dir)
+    for name in (ARCHIVE_JSONL, ARCHIVE_JSON):
+        if (archive_dir / name).exists():
+            return archive_dir / name
+    return None
+
+def iter_archive_lines(archive_dir, size=None):
+    """Yields raw records from the archive in file order, including superseded ones.
+
+    With size, only the archive.jsonl lines within its first size bytes are read, so
+    a caller appending to the archive while iterating does not read its own records.
+    """
+    archive_dir = Path(archive_dir)
+    jsonl_path = archive_dir / ARCHIVE_JSONL
+    if jsonl_path.exists():
+        with open(jsonl_path, 'rb') as f:
+            position = 0
+            for line_no, line in enumerate(f, 1):
+                position += len(line)
+                if size is not None and position > size:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave a truncated last line; it is rewritten on the next run
+                    logger.warning(f"Skipping unreadable line {line_no} in {jsonl_path}")
+        return
+
+    json_path = archive_dir / ARCHIVE_JSON
+    if json_path.exists():
+        with open(json_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        if content.strip():
+            for item in json.loads(content):
+                if isinstance(item, dict) and 'id' in item:
+                    yield item
+
+def read_appended_records(archive_dir, offset):
+    """Returns (records, end offset) for the complete archive.jsonl lines written after byte offset.
+
+    A partly written last line is left for the next call, so the returned offset can
+    be passed back in as the file grows.
+    """
+    jsonl_path = Path(archive_dir) / ARCHIVE_JSONL
+    with open(jsonl_path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    complete = data.rfind(b'\n') + 1
+    records = []
+    for line in data[:complete].splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping unreadable line after offset {offset} in {jsonl_path}")
+    return records, offset + complete
+
+def load_archive(archive_dir):
+    """Returns the current version of every message in the archive, sorted by message ID."""
+    records = {}
+    for record in iter_archive_lines(archive_dir):
+        records[record['id']] = record
+    return [records[msg_id] for msg_id in sorted(records)]
+
+def read_record_at(archive_dir, offset):
+    """Returns the record on the archive.jsonl line that starts at byte offset."""
+    with open(Path(archive_dir) / ARCHIVE_JSONL, 'rb') as f:
+        f.seek(offset)
+        return json.loads(f.readline())
+
+def find_sorted_records(archive_dir, ids, size):
+    """Returns {message ID: record} for the given IDs found in the first size bytes of archive.jsonl.
+
+    That part of the file must hold one line per message sorted by ID, as written by
+    compact_archive(), so each ID is found by a binary search over byte offsets
+    instead of a scan.
+    """
+    found = {}
+    if not ids or not size:
+        return found
+    with open(Path(archive_dir) / ARCHIVE_JSONL, 'rb') as f:
+        def line_from(position):
+            """Returns (start, line) of the first line starting at or after position."""
+            if position > 0:
+                f.seek(position - 1)
+                f.readline() # Rest of the line position falls into
+            else:
+                f.seek(0)
+            start = f.tell()
+            return start, (f.readline() if start < size else b'')
+
+        for msg_id in ids:
+            low, high = 0, size
+            while low < high: # Smallest position whose next line holds an ID >= msg_id
+                middle = (low + high) // 2
+                start, line = line_from(middle)
+                if line and json.loads(line)['id'] < msg_id:
+                    low = start + 1
+                else:
+                    high = middle
+            _, line = line_from(low)
+            if line:
+                record = json.loads(line)
+                if record['id'] == msg_id:
+                    found[msg_id] = record
+    return found
+
+def load_checkpoint(archive_dir):
+    """Returns the checkpoint dict of an archive, or an empty dict if there is none."""
+    checkpoint_path = Path(archive_dir) / CHECKPOINT_FILE
+    if not checkpoint_path.exists():
+        return {}
+    try:
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Could not read checkpoint {checkpoint_path}: {e}")
+        return {}
+
+def write_json_atomic(path, data):
+    """Writes data as JSON to path through a temporary file and os.replace()."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def write_records_atomic(path, records):
+    """Writes records as JSONL to path through a temporary file and os.replace()."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def save_checkpoint(archive_dir, checkpoint):
+    """Atomically replaces the checkpoint file of an archive."""
+    checkpoint = dict(checkpoint)
+    checkpoint['updated_at'] = datetime.now(timezone.utc).isoformat()
+    write_json_atomic(Path(archive_dir) / CHECKPOINT_FILE, checkpoint)
+
+def add_covered_range(checkpoint, low, high):
+    """Marks message IDs low..high (inclusive) as fully scraped in the checkpoint.
+
+    checkpoint['covered_ranges'] is kept sorted, with overlapping and adjacent
+    ranges merged; checkpoint['high_water_mark'] is the highest covered ID.
+    """
+    ranges = sorted(checkpoint.get('covered_ranges', []) + [[low, high]])
+    merged = []
+    for r_low, r_high in ranges:
+        if merged and r_low <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], r_high)
+        else:
+            merged.append([r_low, r_high])
+    checkpoint['covered_ranges'] = merged
+    checkpoint['high_water_mark'] = merged[-1][1]
+
+def missing_id_ranges(checkpoint):
+    """Returns the message ID ranges not yet scraped, newest first.
+
+    Each range is a (min_id, max_id) pair of exclusive bounds as taken by
+    Telethon's iter_messages(); max_id is None for the open-ended range above
+    the high-water mark.
+    """
+    ranges = checkpoint.get('covered_ranges')
+    if not ranges:
+        return [(0, None)]
+    missing = [(ranges[-1][1], None)]
+    for (prev_low, prev_high), (next_low, next_high) in reversed(list(zip(ranges, ranges[1:]))):
+        missing.append((prev_high, next_low))
+    if ranges[0][0] > 1:
+        missing.append((0, ranges[0][0]))
+    return missing
+
+def migrate_json_archive(archive_dir):
+    """Converts a legacy archive.json into archive.jsonl. Returns True if a migration happened.
+
+    The original file is kept as archive.json.bak.
+    """
+    archive_dir = Path(archive_dir)
+    json_path = archive_dir / ARCHIVE_JSON
+    jsonl_path = archive_dir / ARCHIVE_JSONL
+    if jsonl_path.exists() or not json_path.exists():
+        return False
+
+    records = load_archive(archive_dir)
+    write_records_atomic(jsonl_path, records)
+    os.replace(json_path, json_path.with_name(ARCHIVE_JSON + '.bak'))
+    save_checkpoint(archive_dir, {'messages_written': len(records), 'migrated_from': ARCHIVE_JSON,
+                                  'max_id': records[-1]['id'] if records else None,
+                                  'archive_bytes': jsonl_path.stat().st_size})
+    logger.info(f"Migrated {len(records)} messages from {json_path} to {jsonl_path}")
+    return True
+
+def _write_sorted_run(records, path):
+    """Writes {message ID: record} to path as JSONL, sorted by ID."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for msg_id in sorted(records):
+            f.write(json.dumps(records[msg_id], ensure_ascii=False) + '\n')
+
+def _iter_run(path, run_index):
+    """Yields (message ID, -run_index, record) from a sorted run file for heapq.merge()."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            yield record['id'], -run_index, record
+
+def compact_archive(archive_dir):
+    """Rewrites archive.jsonl with one line per message, sorted by ID. Returns the number of messages.
+
+    The log is read in runs of COMPACT_RUN_RECORDS lines. Each run is deduplicated and
+    sorted in memory and spilled to a temporary file, and the runs are then merged, so
+    memory use does not depend on the archive size. When a message ID appears in several
+    runs, the record from the latest run wins, as it would when reading the log in order.
+    """
+    archive_dir = Path(archive_dir)
+    jsonl_path = archive_dir / ARCHIVE_JSONL
+    tmp_path = jsonl_path.with_name(jsonl_path.name + '.tmp')
+    run_paths = []
+    records = {}
+    try:
+        for record in iter_archive_lines(archive_dir):
+            records[record['id']] = record
+            if len(records) >= COMPACT_RUN_RECORDS:
+                run_paths.append(archive_dir / f"{ARCHIVE_JSONL}.run{len(run_paths)}")
+                _write_sorted_run(records, run_paths[-1])
+                records = {}
+
+        count = 0
+        last_id = None
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if not run_paths: # Small archive: a single in-memory run
+                for msg_id in sorted(records):
+                    f.write(json.dumps(records[msg_id], ensure_ascii=False) + '\n')
+                count = len(records)
+                last_id = max(records) if records else None
+            else:
+                if records:
+                    run_paths.append(archive_dir / f"{ARCHIVE_JSONL}.run{len(run_paths)}")
+                    _write_sorted_run(records, run_paths[-1])
+                records = {}
+                runs = [_iter_run(path, run_index) for run_index, path in enumerate(run_paths)]
+                for msg_id, _, record in heapq.merge(*runs, key=lambda item: item[:2]):
+                    if msg_id == last_id:
+                        continue # An older version from an earlier run
+                    last_id = msg_id
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    count += 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, jsonl_path)
+    finally:
+        for path in run_paths:
+            path.unlink(missing_ok=True)
+        tmp_path.unlink(missing_ok=True)
+
+    checkpoint = load_checkpoint(archive_dir)
+    checkpoint['messages_written'] = count
+    checkpoint['max_id'] = last_id
+    checkpoint['archive_bytes'] = jsonl_path.stat().st_size
+    checkpoint.pop('needs_compaction', None)
+    save_checkpoint(archive_dir, checkpoint)
+    return count
+
+def needs_compaction(archive_dir, checkpoint=None):
+    """True if archive.jsonl may hold superseded lines or lines out of ID order.
+
+    ArchiveWriter keeps the file's size, its highest message ID and a
+    'needs_compaction' flag in the checkpoint. A file whose size differs from the
+    recorded one was written without that bookkeeping (an older version, or lines
+    appended just before a crash) and is compacted to be safe.
+    """
+    jsonl_path = Path(archive_dir) / ARCHIVE_JSONL
+    if not jsonl_path.exists():
+        return False
+    if checkpoint is None:
+        checkpoint = load_checkpoint(archive_dir)
+    size = jsonl_path.stat().st_size
+    return bool(checkpoint.get('needs_compaction')) or (size > 0 and checkpoint.get('archive_bytes') != size)
+
+def compact_if_needed(archive_dir):
+    """Compacts the archive only if needs_compaction(). Returns the number of messages."""
+    if needs_compaction(archive_dir):
+        return compact_archive(archive_dir)
+    return load_checkpoint(archive_dir).get('messages_written', 0)
+
+def _first_and_last_records(jsonl_path):
+    """Returns the first and last records of a JSONL file without reading the lines in between."""
+    with open(jsonl_path, 'rb') as f:
+        first_line = f.readline()
+        end = f.seek(0, os.SEEK_END)
+        position, tail = end, b''
+        while position > 0 and tail.rstrip(b'\n').count(b'\n') == 0:
+            position = max(0, position - 65536)
+            f.seek(position)
+            tail = f.read(end - position)
+    last_line = tail.rstrip(b'\n').rsplit(b'\n', 1)[-1]
+    try:
+        return json.loads(first_line), json.loads(last_line)
+    except json.JSONDecodeError:
+        return None, None
+
+def archive_summary(archive_dir, message_count=None):
+    """Returns the catalog entry of an archive: message count, date span, size and update time.
+
+    message_count defaults to the count compact_archive() left in the checkpoint. The
+    date span is read from the first and last lines of the compacted archive, since
+    message IDs grow with time. Legacy archives, and archives without a recorded
+    count, are read once instead.
+    """
+    archive_dir = Path(archive_dir)
+    archive_path = archive_file(archive_dir)
+    if message_count is None:
+        message_count = load_checkpoint(archive_dir).get('messages_written')
+    if archive_path.name == ARCHIVE_JSONL and message_count is not None and not needs_compaction(archive_dir):
+        first, last = _first_and_last_records(archive_path) if message_count else (None, None)
+    else:
+        ids, first, last = MessageIdSet(), None, None
+        for record in iter_archive_lines(archive_dir):
+            ids.add(record['id'])
+            if first is None or record['id'] <= first['id']:
+                first = record
+            if last is None or record['id'] >= last['id']:
+                last = record
+        message_count = len(ids)
+    return {
+        'message_count': message_count,
+        'first_date': first.get('date') if first else None,
+        'last_date': last.get('date') if last else None,
+        'size_bytes': archive_path.stat().st_size,
+        'updated_at': datetime.now(timezone.utc).isoformat()
+    }
+
+def catalog_groups(output_dir):
+    """Returns the sorted names of the group directories in output_dir."""
+    return sorted(entry.name for entry in os.scandir(output_dir) if entry.name.startswith('group_') and entry.is_dir())
+
+def load_catalog(output_dir):
+    """Returns the catalog of output_dir, or None if it is missing, unreadable or of another version."""
+    catalog_path = Path(output_dir) / CATALOG_FILE
+    if not catalog_path.exists():
+        return None
+    try:
+        with open(catalog_path, 'r', encoding='utf-8') as f:
+            catalog = json.load(f)
+    except Exception as e:
+        logger.warning(f"Could not read catalog {catalog_path}: {e}")
+        return None
+    if not isinstance(catalog, dict) or catalog.get('version') != CATALOG_VERSION:
+        return None
+    return catalog
+
+def update_catalog(output_dir, archive_dirs):
+    """Refreshes the catalog entries of archive_dirs and atomically rewrites output_dir/catalog.json.
+
+    archive_dirs maps archive directories to their message counts (None to read the
+    count from the checkpoint). Entries are keyed by the archive path relative to
+    output_dir, e.g. 'group_-100123/complete_archive'. The catalog also records the
+    group directories that existed when it was written, which is how the viewer
+    notices archives added without a catalog update. A missing or unreadable catalog
+    is first rebuilt from every archive below output_dir, so it never lists only
+    the archives of the latest run.
+    """
+    output_dir = Path(output_dir)
+    lock_file = open(output_dir / (CATALOG_FILE + '.lock'), 'w')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX) # Concurrent scrapers must not drop each other's entries
+        catalog = load_catalog(output_dir)
+        if catalog is None:
+            catalog = {'version': CATALOG_VERSION, 'archives': {}}
+            archive_dirs = {**{archive_dir: None for archive_dir in find_archive_dirs(output_dir)}, **archive_dirs}
+        for archive_dir, message_count in archive_dirs.items():
+            key = Path(archive_dir).resolve().relative_to(output_dir.resolve()).as_posix()
+            catalog['archives'][key] = archive_summary(archive_dir, message_count)
+        # Entries of archives that were deleted since the last update
+        catalog['archives'] = {key: entry for key, entry in sorted(catalog['archives'].items())
+                               if archive_exists(output_dir / key)}
+        catalog['groups'] = catalog_groups(output_dir)
+        catalog['updated_at'] = datetime.now(timezone.utc).isoformat()
+        write_json_atomic(output_dir / CATALOG_FILE, catalog)
+    finally:
+        lock_file.close()
+    return catalog
+
+def find_archive_dirs(output_dir):
+    """Returns the directories below output_dir that hold an archive in either format, sorted."""
+    return sorted({path.parent for name in (ARCHIVE_JSONL, ARCHIVE_JSON)
+                   for path in Path(output_dir).glob(f"group_*/*/{name}")})
+
+def rebuild_catalog(output_dir):
+    """Writes a catalog of every archive below output_dir. Returns the number of archives."""
+    archive_dirs = {archive_dir: None for archive_dir in find_archive_dirs(output_dir)}
+    return len(update_catalog(output_dir, archive_dirs)['archives'])
+
+class MessageIdSet:
+    """Set of message IDs kept as a paged bitmap, one bit per possible ID.
+
+    Message IDs are dense within a chat, so millions of IDs take a few hundred KB
+    instead of the ~70 bytes per entry of a set of ints. Pages are allocated on
+    first use, so sparse IDs (e.g. in basic groups) only pay for the pages they touch.
+    """
+
+    PAGE_IDS = 1 << 16
+
+    def __init__(self, ids=()):
+        self._pages = {}
+        self._count = 0
+        self.update(ids)
+
+    def add(self, msg_id):
+        page, bit = divmod(msg_id, self.PAGE_IDS)
+        bits = self._pages.get(page)
+        if bits is None:
+            bits = self._pages[page] = bytearray(self.PAGE_IDS // 8)
+        mask = 1 << (bit & 7)
+        if not bits[bit >> 3] & mask:
+            bits[bit >> 3] |= mask
+            self._count += 1
+
+    def update(self, ids):
+        for msg_id in ids:
+            self.add(msg_id)
+
+    def clear(self):
+        self._pages.clear()
+        self._count = 0
+
+    def intersection(self, ids):
+        return {msg_id for msg_id in ids if msg_id in self}
+
+    def __contains__(self, msg_id):
+        page, bit = divmod(msg_id, self.PAGE_IDS)
+        bits = self._pages.get(page)
+        return bits is not None and bool(bits[bit >> 3] & (1 << (bit & 7)))
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for page in sorted(self._pages):
+            bits = self._pages[page]
+            for byte_index, byte in enumerate(bits):
+                if byte:
+                    for bit in range(8):
+                        if byte & (1 << bit):
+                            yield page * self.PAGE_IDS + byte_index * 8 + bit
+
+def sqlite_exists(archive_dir):
+    """True if archive_dir has an SQLite index."""
+    return (Path(archive_dir) / ARCHIVE_SQLITE).exists()
+
+class SqliteArchive:
+    """Indexed SQLite copy of an archive, with full-text search over the message text.
+
+    The database runs in WAL mode, so the viewer can read while the scraper writes.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            date TEXT,
+            sender_id INTEGER,
+            sender_username TEXT,
+            sender_first_name TEXT,
+            sender_last_name TEXT,
+            text TEXT,
+            has_media INTEGER,
+            media_filename TEXT,
+            has_links INTEGER,
+            reply_to_message_id INTEGER,
+            record TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_date ON messages(date);
+        CREATE INDEX IF NOT EXISTS idx_messages_sender_id ON messages(sender_id);
+        CREATE INDEX IF NOT EXISTS idx_messages_reply_to ON messages(reply_to_message_id);
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, content='messages', content_rowid='id');
+        CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE OF text ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+        END;
+    """
+
+    def __init__(self, archive_dir, readonly=False):
+        self.path = Path(archive_dir) / ARCHIVE_SQLITE
+        if readonly:
+            self.conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True, timeout=30)
+        else:
+            self.conn = sqlite3.connect(self.path, timeout=30)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(self.SCHEMA)
+
+    def upsert(self, records):
+        """Inserts records, replacing existing rows with the same message ID (last write wins)."""
+        placeholders = ', '.join('?' for _ in SQLITE_COLUMNS)
+        updates = ', '.join(f"{col} = excluded.{col}" for col in SQLITE_COLUMNS[1:])
+        rows = [[record.get(col) for col in SQLITE_COLUMNS] + [json.dumps(record, ensure_ascii=False)]
+                for record in records]
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO messages ({', '.join(SQLITE_COLUMNS)}, record) VALUES ({placeholders}, ?) "
+                f"ON CONFLICT(id) DO UPDATE SET {updates}, record = excluded.record", rows)
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def message_ids(self):
+        """Yields every archived message ID (read from the primary key index)."""
+        for (msg_id,) in self.conn.execute("SELECT id FROM messages"):
+            yield msg_id
+
+    def senders(self):
+        """Returns (sender_id, username, first_name, last_name) for every distinct sender."""
+        return self.conn.execute(
+            "SELECT DISTINCT sender_id, sender_username, sender_first_name, sender_last_name "
+            "FROM messages WHERE sender_id IS NOT NULL").fetchall()
+
+    def query(self, sender_ids=None, search=None):
+        """Returns the records matching the filters, sorted by message ID.
+
+        sender_ids restricts to those senders (index lookup); search is an FTS5 query on the text.
+        """
+        sql = "SELECT m.record FROM messages m"
+        conditions, params = [], []
+        if search:
+            sql += " JOIN messages_fts f ON f.rowid = m.id"
+            conditions.append("messages_fts MATCH ?")
+            params.append(search)
+        if sender_ids is not None:
+            conditions.append(f"m.sender_id IN ({', '.join('?' for _ in sender_ids)})")
+            params.extend(sender_ids)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY m.id"
+        return [json.loads(record) for (record,) in self.conn.execute(sql, params)]
+
+    def close(self):
+        self.conn.close()
+
+def build_sqlite_index(archive_dir):
+    """Creates or refreshes archive.sqlite from the archive file. Returns the message count."""
+    db = SqliteArchive(archive_dir)
+    try:
+        batch = []
+        for record in iter_archive_lines(archive_dir):
+            batch.append(record)
+            if len(batch) >= 5000:
+                db.upsert(batch)
+                batch = []
+        db.upsert(batch)
+        return db.count()
+    finally:
+        db.close()
+
+class ArchiveWriter:
+    """Appends message records to archive.jsonl and records progress in checkpoint.json.
+
+    Every append() is flushed and fsynced before the checkpoint is updated, so
+    after a crash the archive holds at least everything the checkpoint claims.
+    The records are also upserted into archive.sqlite with use_sqlite, or whenever
+    the archive already has one, since the viewer queries it as soon as it exists.
+
+    The checkpoint also tracks the file's size ('archive_bytes') and highest
+    message ID ('max_id'). A record at or below that ID (an update, or a message
+    older than the newest one archived) sets 'needs_compaction', so the archive is
+    only rewritten by compact_if_needed() when appends broke its ID order.
+    """
+
+    def __init__(self, archive_dir, use_sqlite=False):
+        self.archive_dir = Path(archive_dir)
+        self.path = self.archive_dir / ARCHIVE_JSONL
+        self.checkpoint = load_checkpoint(self.archive_dir)
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self._repair_tail()
+        if needs_compaction(self.archive_dir, self.checkpoint):
+            self.checkpoint['needs_compaction'] = True
+        self.size = self.path.stat().st_size if self.path.exists() else 0
+        self._file = open(self.path, 'ab')
+        self.sqlite = None
+        if use_sqlite or sqlite_exists(self.archive_dir):
+            if not sqlite_exists(self.archive_dir) and self.path.stat().st_size > 0:
+                logger.info(f"Building SQLite index for {self.archive_dir}")
+                build_sqlite_index(self.archive_dir)
+            self.sqlite = SqliteArchive(self.archive_dir)
+
+    def _repair_tail(self):
+        """Cuts off a partially written last line left behind by a crash."""
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return
+        with open(self.path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b'\n':
+                return
+            # Walk back to the last complete line
+            pos = f.seek(0, os.SEEK_END)
+            while pos > 0:
+                step = min(65536, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step)
+                newline_at = chunk.rfind(b'\n')
+                if newline_at != -1:
+                    f.truncate(pos + newline_at + 1)
+                    break
+            else:
+                f.truncate(0)
+        logger.warning(f"Removed a partially written record at the end of {self.path}")
+
+    def append(self, records):
+        """Durably appends records and updates the checkpoint. Returns the byte offset of each record's line."""
+        if not records:
+            return []
+        max_id = self.checkpoint.get('max_id')
+        in_order = True
+        for record in records:
+            if max_id is not None and record['id'] <= max_id:
+                in_order = False
+            max_id = record['id'] if max_id is None else max(max_id, record['id'])
+        if not in_order and not self.checkpoint.get('needs_compaction'):
+            # Saved before the lines are written, so a crash cannot leave them unnoticed. The
+            # checkpoint on disk is used, as the in-memory one may already cover these records.
+            self.checkpoint['needs_compaction'] = True
+            saved_checkpoint = load_checkpoint(self.archive_dir)
+            saved_checkpoint['needs_compaction'] = True
+            save_checkpoint(self.archive_dir, saved_checkpoint)
+
+        offsets = []
+        lines = []
+        for record in records:
+            line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+            offsets.append(self.size)
+            lines.append(line)
+            self.size += len(line)
+        self._file.write(b''.join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if self.sqlite is not None:
+            self.sqlite.upsert(records)
+        self.checkpoint['messages_written'] = self.checkpoint.get('messages_written', 0) + len(records)
+        self.checkpoint['last_message_id'] = records[-1]['id']
+        self.checkpoint['max_id'] = max_id
+        self.checkpoint['archive_bytes'] = self.size
+        save_checkpoint(self.archive_dir, self.checkpoint)
+        return offsets
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if self.sqlite is not None:
+            self.sqlite.close()
+            self.sqlite = None
+
+def migrate_output_dir(output_dir):
+    """Migrates every legacy archive.json below output_dir. Returns the number migrated."""
+    migrated = 0
+    for json_path in sorted(Path(output_dir).glob(f"group_*/*/{ARCHIVE_JSON}")):
+        if migrate_json_archive(json_path.parent):
+            migrated += 1
+    return migrated
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    target_dir = sys.argv[1] if len(sys.argv) > 1 else "output"
+    count = migrate_output_dir(target_dir)
+    print(f"✅ Migrated {count} archive(s) in {target_dir} to {ARCHIVE_JSONL}")
+    print(f"🗂️ Catalog of {rebuild_catalog(target_dir)} archive(s) written to {Path(target_dir) / CATALOG_FILE}")
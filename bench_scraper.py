@@ -0,0 +1,376 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Offline end-to-end benchmark of tgscrap.run_scraper().
+
+Runs the real scraper against FakeTelegramClient, an in-process stand-in for
+TelegramClient that generates a synthetic history, so no account or network is
+needed. Each scenario runs in its own subprocess and temporary directory, so
+peak RSS and on-disk state are measured per scenario.
+
+Example:
+    python bench_scraper.py --messages 10000 100000 --latency 0.02 --media_ratio 0.1
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from telethon.errors import FloodWaitError
+
+try:
+    import resource # Not available on Windows
+except ImportError:
+    resource = None
+
+PAGE_SIZE = 100 # Messages per fake GetHistoryRequest, like Telethon
+BASE_DATE = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+class FakeEntity:
+    def __init__(self, entity_id, username=None, first_name=None, last_name=None, title=None):
+        self.id = entity_id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.title = title
+
+class FakeDocument:
+    def __init__(self, doc_id, size, mime_type, file_name):
+        self.id = doc_id
+        self.size = size
+        self.mime_type = mime_type
+        self.attributes = [FakeFileNameAttribute(file_name)]
+
+class FakeFileNameAttribute:
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+class FakePhotoSize:
+    def __init__(self, size):
+        self.size = size
+
+class FakePhoto:
+    def __init__(self, photo_id, size):
+        self.id = photo_id
+        self.sizes = [FakePhotoSize(size // 10), FakePhotoSize(size)]
+
+class FakeMediaDocument:
+    def __init__(self, document):
+        self.document = document
+
+class FakeMediaPhoto:
+    def __init__(self, photo):
+        self.photo = photo
+
+class FakeReplyHeader:
+    def __init__(self, reply_to_msg_id, reply_to_top_id=None, forum_topic=False):
+        self.reply_to_msg_id = reply_to_msg_id
+        self.reply_to_top_id = reply_to_top_id
+        self.forum_topic = forum_topic
+
+class FakeMessage:
+    def __init__(self, msg_id, date, sender_id, sender, text, media=None, reply_to=None):
+        self.id = msg_id
+        self.date = date
+        self.edit_date = None
+        self.sender_id = sender_id
+        self.sender = sender
+        self.text = text
+        self.message = text
+        self.media = media
+        self.reply_to = reply_to
+        self.reply_to_msg_id = reply_to.reply_to_msg_id if reply_to else None
+
+class FakeTelegramClient:
+    """In-process stand-in for the parts of TelegramClient used by tgscrap.
+
+    Message i (1..message_count) is generated deterministically from its ID, so
+    histories of any size cost no memory. Every request sleeps for `latency`
+    seconds; every `flood_every`-th request raises FloodWaitError(flood_seconds).
+    """
+
+    def __init__(self, message_count, latency=0.0, flood_every=0, flood_seconds=1,
+                 media_ratio=0.0, media_size=100 * 1024, duplicate_media_ratio=0.0,
+                 bandwidth=50 * 1024 * 1024, users=1000, missing_sender_ratio=0.0, topics=0):
+        self.message_count = message_count
+        self.latency = latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.media_ratio = media_ratio
+        self.media_size = media_size
+        self.duplicate_media_ratio = duplicate_media_ratio
+        self.bandwidth = bandwidth
+        self.users = users
+        self.missing_sender_ratio = missing_sender_ratio
+        self.topics = topics
+        self.requests = 0
+        self.flood_sleep_threshold = 0
+        self._connected = False
+
+    # Connection ---------------------------------------------------------
+
+    async def connect(self):
+        self._connected = True
+
+    def is_connected(self):
+        return self._connected
+
+    async def is_user_authorized(self):
+        return True
+
+    async def disconnect(self):
+        self._connected = False
+
+    # Requests -----------------------------------------------------------
+
+    async def _request(self, transfer_bytes=0):
+        self.requests += 1
+        if self.flood_every and self.requests % self.flood_every == 0:
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+        delay = self.latency + (transfer_bytes / self.bandwidth if self.bandwidth else 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _user(self, user_id):
+        return FakeEntity(user_id, username=f"user{user_id}", first_name=f"First{user_id}", last_name=f"Last{user_id}")
+
+    def topic_of(self, msg_id):
+        """Forum topic (its root message ID) that message msg_id belongs to, or None."""
+        if not self.topics or msg_id <= self.topics:
+            return None # The first messages are the topic roots themselves
+        return (msg_id % self.topics) + 1
+
+    def make_message(self, msg_id):
+        rng = random.Random(msg_id)
+        sender_id = rng.randint(1, self.users)
+        sender = None if rng.random() < self.missing_sender_ratio else self._user(sender_id)
+        text = " ".join(rng.choice(("hello", "world", "**bold**", "https://example.com", "_it_", "`code`", "lorem", "ipsum"))
+                        for _ in range(rng.randint(3, 30)))
+        media = None
+        if rng.random() < self.media_ratio:
+            # Duplicates reuse a small pool of document IDs, like reposts
+            doc_id = rng.randint(1, 50) if rng.random() < self.duplicate_media_ratio else 10_000_000 + msg_id
+            kind = rng.random()
+            size = max(1, int(self.media_size * rng.uniform(0.5, 1.5)))
+            if kind < 0.5:
+                media = FakeMediaPhoto(FakePhoto(doc_id, size))
+            elif kind < 0.75:
+                media = FakeMediaDocument(FakeDocument(doc_id, size, 'video/mp4', f"video{doc_id}.mp4"))
+            else:
+                media = FakeMediaDocument(FakeDocument(doc_id, size, 'application/pdf', f"file{doc_id}.pdf"))
+        topic = self.topic_of(msg_id)
+        reply_to = None
+        if topic:
+            reply_to = FakeReplyHeader(topic, reply_to_top_id=None, forum_topic=True)
+        elif msg_id > 1 and rng.random() < 0.2:
+            reply_to = FakeReplyHeader(rng.randint(1, msg_id - 1))
+        return FakeMessage(msg_id, BASE_DATE + timedelta(minutes=msg_id), sender_id, sender, text, media, reply_to)
+
+    async def get_entity(self, entity):
+        if isinstance(entity, (list, tuple)):
+            await self._request()
+            return [self._user(e) for e in entity]
+        await self._request()
+        if isinstance(entity, int) and entity < 0:
+            return FakeEntity(entity, title=f"Group {entity}")
+        return self._user(entity)
+
+    async def iter_messages(self, entity, limit=None, offset_id=0, max_id=0, min_id=0, reply_to=None, ids=None,
+                            reverse=False, **kwargs):
+        if ids is not None:
+            await self._request()
+            for msg_id in ids:
+                yield self.make_message(msg_id) if 1 <= msg_id <= self.message_count else None
+            return
+        upper = self.message_count
+        if max_id:
+            upper = min(upper, max_id - 1)
+        yielded = 0
+        if reverse: # Oldest first; offset_id is an exclusive lower bound, as in Telethon
+            msg_id = max(min_id, offset_id)
+            while msg_id < upper:
+                await self._request() # One history page
+                page_end = min(upper, msg_id + PAGE_SIZE)
+                for current in range(msg_id + 1, page_end + 1):
+                    if reply_to is not None and self.topic_of(current) != reply_to:
+                        continue
+                    yield self.make_message(current)
+                    yielded += 1
+                    if limit is not None and yielded >= limit:
+                        return
+                msg_id = page_end
+            return
+        if offset_id:
+            upper = min(upper, offset_id - 1)
+        msg_id = upper
+        while msg_id > min_id:
+            await self._request() # One history page
+            page_end = max(min_id, msg_id - PAGE_SIZE)
+            for current in range(msg_id, page_end, -1):
+                if reply_to is not None and self.topic_of(current) != reply_to:
+                    continue
+                yield self.make_message(current)
+                yielded += 1
+                if limit is not None and yielded >= limit:
+                    return
+            msg_id = page_end
+
+    async def get_messages(self, entity, ids=None, **kwargs):
+        if ids is None:
+            return [msg async for msg in self.iter_messages(entity, **kwargs)]
+        return [msg async for msg in self.iter_messages(entity, ids=ids)]
+
+    async def download_media(self, media, file=None, **kwargs):
+        size = self._media_size(media)
+        await self._request(size)
+        with open(file, 'wb') as f:
+            f.truncate(size) # Sparse file of the right size
+        return file
+
+    async def iter_download(self, file, offset=0, request_size=512 * 1024, limit=None, file_size=None, **kwargs):
+        size = file_size if file_size is not None else getattr(file, 'size', self.media_size)
+        position = offset
+        chunks = 0
+        while position < size and (limit is None or chunks < limit):
+            length = min(request_size, size - position)
+            await self._request(length)
+            yield bytes(length)
+            position += length
+            chunks += 1
+
+    def _media_size(self, media):
+        document = getattr(media, 'document', None)
+        if document is not None:
+            return document.size
+        photo = getattr(media, 'photo', None)
+        if photo is not None:
+            return photo.sizes[-1].size
+        return self.media_size
+
+    def add_event_handler(self, callback, event=None):
+        pass
+
+async def run_scenario(args):
+    """Runs one scenario in the current process and returns its result dict."""
+    import tgscrap # Imported here so its log file lands in the scenario's working directory
+
+    if not args.real_limits:
+        for limiter in tgscrap.RATE_LIMITERS.values():
+            limiter.rate = limiter.max_rate = 1e9
+            limiter.burst = limiter.tokens = 1e9
+    tgscrap.DOWNLOAD_MEDIA = args.media_ratio > 0
+    tgscrap.MEDIA_DOWNLOAD_WORKERS = args.media_workers
+    tgscrap.TABULAR_EXPORT = args.export
+    tgscrap.client = FakeTelegramClient(
+        args.messages, latency=args.latency, flood_every=args.flood_every, flood_seconds=args.flood_seconds,
+        media_ratio=args.media_ratio, media_size=args.media_size, duplicate_media_ratio=args.duplicate_media_ratio,
+        bandwidth=args.bandwidth_mb * 1024 * 1024, users=args.users, missing_sender_ratio=args.missing_sender_ratio)
+
+    group_id = -1000000000001
+    started = time.perf_counter()
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        result = await tgscrap.run_scraper(group_id)
+    elapsed = time.perf_counter() - started
+
+    stats_path = tgscrap.get_archive_dir(group_id) / tgscrap.RUN_STATS_FILE
+    with open(stats_path, 'r', encoding='utf-8') as f:
+        run_stats = json.load(f)
+    peak_rss_mb = None
+    if resource is not None:
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_rss_mb = peak_rss_kb / (1024 * 1024) if sys.platform == 'darwin' else peak_rss_kb / 1024 # Bytes on macOS
+    return {
+        'messages': args.messages,
+        'new_messages': result['new_messages'] if result else 0,
+        'elapsed_seconds': round(elapsed, 3),
+        'messages_per_second': round(args.messages / elapsed, 1) if elapsed else None,
+        'peak_rss_mb': round(peak_rss_mb, 1) if peak_rss_mb is not None else None,
+        'fake_requests': tgscrap.client.requests,
+        'stage_seconds': run_stats['stage_seconds'],
+        'counters': run_stats['counters'],
+        'throttled_seconds': run_stats['throttling']['total_seconds']
+    }
+
+def scenario_arguments(args, message_count):
+    """Command line forwarded to the subprocess running one scenario."""
+    forwarded = [sys.executable, os.path.abspath(__file__), '--single', '--messages', str(message_count)]
+    for name in ('latency', 'flood_every', 'flood_seconds', 'media_ratio', 'media_size', 'duplicate_media_ratio',
+                 'bandwidth_mb', 'users', 'missing_sender_ratio', 'media_workers', 'export'):
+        forwarded += [f"--{name}", str(getattr(args, name))]
+    if args.real_limits:
+        forwarded.append('--real_limits')
+    return forwarded
+
+def print_result(result):
+    print(f"📊 {result['messages']:>9} messages | {result['messages_per_second']:>9.1f} msg/s | "
+          f"{result['elapsed_seconds']:>8.2f}s | peak RSS {result['peak_rss_mb']} MB | "
+          f"{result['fake_requests']} requests | throttled {result['throttled_seconds']}s")
+    print("     stages: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result['stage_seconds'].items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Telegram scraper against a fake client.")
+    parser.add_argument("--messages", type=int, nargs='+', default=[10000, 100000],
+                        help="History sizes to benchmark (one scenario each). (Default: 10000 100000)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every fake request.")
+    parser.add_argument("--flood_every", type=int, default=0, help="Raise FloodWaitError on every Nth request (0 = never).")
+    parser.add_argument("--flood_seconds", type=int, default=1, help="Seconds requested by injected FloodWaitErrors.")
+    parser.add_argument("--media_ratio", type=float, default=0.0, help="Fraction of messages with media (0 disables downloads).")
+    parser.add_argument("--media_size", type=int, default=100 * 1024, help="Size of each synthetic media file in bytes.")
+    parser.add_argument("--duplicate_media_ratio", type=float, default=0.0, help="Fraction of media reusing an already seen file.")
+    parser.add_argument("--bandwidth_mb", type=float, default=50.0, help="Simulated download bandwidth in MB/s.")
+    parser.add_argument("--users", type=int, default=1000, help="Number of distinct senders.")
+    parser.add_argument("--missing_sender_ratio", type=float, default=0.0,
+                        help="Fraction of messages without an attached sender entity (forces user lookups).")
+    parser.add_argument("--media_workers", type=int, default=4, help="Concurrent media downloads.")
+    parser.add_argument("--export", choices=['excel', 'csv', 'both', 'none'], default='none',
+                        help="Tabular export at the end of the run. (Default: none)")
+    parser.add_argument("--real_limits", action='store_true',
+                        help="Keep the production rate limits instead of disabling them.")
+    parser.add_argument("--json", dest='json_path', help="Also write all results to this JSON file.")
+    parser.add_argument("--single", action='store_true', help=argparse.SUPPRESS) # Internal: run one scenario here
+    args = parser.parse_args()
+
+    if args.single:
+        args.messages = args.messages[0]
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        result = asyncio.run(run_scenario(args))
+        print(json.dumps(result))
+        return
+
+    results = []
+    for message_count in args.messages:
+        with tempfile.TemporaryDirectory(prefix='gramscrap_bench_') as work_dir:
+            completed = subprocess.run(scenario_arguments(args, message_count), cwd=work_dir,
+                                       capture_output=True, text=True, encoding='utf-8')
+        if completed.returncode != 0:
+            print(f"❌ Scenario with {message_count} messages failed:\n{completed.stderr}")
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print_result(result)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Results saved: {args.json_path}")
+
+if __name__ == '__main__':
+    main()
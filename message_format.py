@@ -0,0 +1,89 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Telegram-style message markup to HTML, shared by the scraper (tgscrap.py) and the viewer (app.py).
+
+The scraper stores the rendered HTML in each record ('text_html', with the
+'text_html_version' it was rendered with), so the viewer and the export only
+render records written by older versions.
+
+Supported markup: [label](url) links and bare URLs, **bold**, __italics__,
+_italics_, ~~strikethrough~~, `inline code` and ```code blocks``` (with an
+optional language line). Everything else is HTML-escaped.
+"""
+
+import html
+import re
+
+# Bump when the output of render_text_html() changes, so stored HTML is rendered again
+FORMAT_VERSION = 2
+
+# One alternation of every token, scanned left to right in a single pass. Where two
+# tokens start at the same position, the earlier alternative wins (code before links
+# before emphasis), so code and URLs are never broken up by emphasis markers.
+# Bare URLs do not end in punctuation, which belongs to the surrounding sentence.
+TOKEN_RE = re.compile(r'''
+    (?P<pre>```(?:[a-zA-Z_0-9\-]*\n)?(?P<pre_body>[\s\S]+?)```)
+  | (?P<code>`(?P<code_body>[^`\n]+?)`)
+  | (?P<mdlink>\[(?P<mdlink_label>[^\]\n]+?)\]\((?P<mdlink_url>https?://[^\s)]+)\))
+  | (?P<url>https?://(?:[\w\-./?=&%:#~+@!,;]|%[\da-fA-F]{2})+(?<![.,;:!?]))
+  | (?P<bold>\*\*(?P<bold_body>.+?)\*\*)
+  | (?P<em2>__(?P<em2_body>.+?)__)
+  | (?P<em>(?<![\w_])_(?![_\s])(?P<em_body>.+?)(?<![_\s])_(?![\w_]))
+  | (?P<strike>~~(?P<strike_body>.+?)~~)
+  | (?P<newline>\n)
+''', re.VERBOSE)
+
+# Emphasis tokens: group name -> HTML tag wrapped around the rendered body
+EMPHASIS_TAGS = {'bold': 'strong', 'em2': 'em', 'em': 'em', 'strike': 'del'}
+
+def _link(url, label_html):
+    return f'<a href="{html.escape(url, quote=True)}" target="_blank" class="chat-link">{label_html}</a>'
+
+def _render(text):
+    parts = []
+    position = 0
+    for match in TOKEN_RE.finditer(text):
+        parts.append(html.escape(text[position:match.start()], quote=False))
+        position = match.end()
+        if match.group('pre') is not None:
+            parts.append(f"<pre><code>{html.escape(match.group('pre_body'), quote=False)}</code></pre>")
+        elif match.group('code') is not None:
+            parts.append(f"<code>{html.escape(match.group('code_body'), quote=False)}</code>")
+        elif match.group('mdlink') is not None:
+            parts.append(_link(match.group('mdlink_url'), html.escape(match.group('mdlink_label'), quote=False)))
+        elif match.group('url') is not None:
+            url = match.group('url')
+            parts.append(_link(url, html.escape(url, quote=False)))
+        elif match.group('newline') is not None:
+            parts.append('<br>')
+        else:
+            for name, tag in EMPHASIS_TAGS.items():
+                if match.group(name) is not None:
+                    # Emphasis bodies are single-line and may contain links, code or other emphasis
+                    parts.append(f"<{tag}>{_render(match.group(name + '_body'))}</{tag}>")
+                    break
+    parts.append(html.escape(text[position:], quote=False))
+    return ''.join(parts)
+
+def render_text_html(text):
+    """Returns the HTML of a message text with its markup rendered and everything else escaped."""
+    if not text:
+        return ""
+    return _render(str(text))
+
+def record_text_html(record):
+    """Returns a record's stored HTML if it is current, rendering the text otherwise."""
+    if record.get('text_html_version') == FORMAT_VERSION and 'text_html' in record:
+        return record['text_html']
+    return render_text_html(record.get('text', ''))
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("PIL")
+from PIL import Image
+
+import archive_store
+import tgscrap
+
+
+@pytest.fixture
+def archive_dir(tmp_path):
+    media_dir = tmp_path / "media"
+    media_dir.mkdir()
+    for name in ("1.jpg", "2.jpg", "3.jpg"):
+        Image.new("RGB", (64, 64), "red").save(media_dir / name)
+    writer = archive_store.ArchiveWriter(tmp_path)
+    writer.append([{'id': msg_id, 'text': f"message {msg_id}", 'media_filename': f"{msg_id}.jpg"}
+                   for msg_id in (1, 2, 3)])
+    # Later versions, not compacted yet: 1 was deleted, the media of 2 was removed by an edit
+    writer.append([{'id': 1, 'text': "message 1", 'media_filename': "1.jpg", 'deleted': True},
+                   {'id': 2, 'text': "edited", 'media_filename': None}])
+    writer.close()
+    yield tmp_path
+    if tgscrap.thumbnail_pool is not None:
+        tgscrap.thumbnail_pool.shutdown()
+        tgscrap.thumbnail_pool = None
+
+
+def test_thumbnails_skip_superseded_versions(archive_dir, monkeypatch):
+    monkeypatch.setattr(tgscrap, 'THUMBNAIL_WORKERS', 1)
+    assert asyncio.run(tgscrap.generate_thumbnails(archive_dir)) == 1
+    archive_store.compact_if_needed(archive_dir)
+
+    records = {record['id']: record for record in archive_store.load_archive(archive_dir)}
+    assert records[1].get('deleted') is True
+    assert 'thumbnail_filename' not in records[1]
+    assert records[2]['text'] == "edited"
+    assert records[2]['media_filename'] is None
+    assert records[3]['thumbnail_filename'] == tgscrap.thumbnail_name("3.jpg")
@@ -12,20 +12,51 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from telethon.sync import TelegramClient
+from telethon import events
 from telethon.errors import SessionPasswordNeededError, FloodWaitError
 from telethon.tl.functions.messages import GetHistoryRequest
+from telethon.tl.types import MessageActionTopicCreate
 import json
 from datetime import datetime
-import pandas as pd
 import time
 import asyncio
 import logging
 import os
 import shutil
+import hashlib
+import random
+import signal
 from pathlib import Path
 import re
 from urllib.parse import urlparse
 import argparse
+import csv
+import contextvars
+import threading
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+# Optional dependency for the Parquet dataset (--parquet)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Optional dependency for image thumbnails (--thumbnails); video posters also need ffmpeg
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import archive_store
+import message_format
 
 # Logging configuration
 logging.basicConfig(
@@ -50,10 +81,23 @@ API_HASH = None
 PHONE = None
 DEFAULT_GROUP_ID = None # Default if not provided by config or arg
 DEFAULT_TOPIC_ID = None # Default if not provided by config or arg
+TARGETS = [] # (group_id, topic_id) pairs scraped together when no target is given on the command line
+MAX_CONCURRENT_TARGETS = 3 # Targets scraped at the same time over the shared client
+SESSIONS = [] # Additional sessions ({'name', 'phone'}) that share the history download of each target
+TABULAR_EXPORT = 'excel' # 'excel', 'csv', 'both' or 'none' (overridable with --export)
+EXPORT_MIN_NEW_MESSAGES = 0 # Defer the tabular export until this many new messages accumulated
+PARQUET_EXPORT = False # Maintain a month-partitioned Parquet dataset (enable with --parquet)
+SQLITE_INDEX = False # Keep archive.sqlite (indexes + full-text search) in sync (enable with --sqlite)
+THUMBNAILS = False # Generate thumbnails and video posters after each scrape (enable with --thumbnails)
+SPLIT_TOPICS = False # Group scrapes also fill the archive of every forum topic (enable with --split_topics)
+OUTPUT_DIR = Path("output") # Root of all archives; also holds the catalog (archive_store.CATALOG_FILE)
+RUN_STATS_FILE = "run_stats.json" # Per-stage timings and counters of the last run, in each archive directory
+PARQUET_DIR_NAME = "parquet"
+PARQUET_BATCH_ROWS = 50000 # Rows buffered in memory before a Parquet part file is written
 
 def load_configuration():
     """Loads configuration from config.json and then environment variables."""
-    global API_ID, API_HASH, PHONE, DEFAULT_GROUP_ID, DEFAULT_TOPIC_ID
+    global API_ID, API_HASH, PHONE, DEFAULT_GROUP_ID, DEFAULT_TOPIC_ID, TARGETS, MAX_CONCURRENT_TARGETS, SESSIONS
 
     config = {}
     # 1. Try to load from config.json
@@ -105,105 +149,611 @@ def load_configuration():
     DEFAULT_GROUP_ID = get_config_value("telegram_default_group_id", "TELEGRAM_DEFAULT_GROUP_ID", is_int=True, default_val=-1000000000000) # Your previous hardcoded default
     DEFAULT_TOPIC_ID = get_config_value("telegram_default_topic_id", "TELEGRAM_DEFAULT_TOPIC_ID", is_int=True) # No hardcoded default for topic_id, can be None
 
+    MAX_CONCURRENT_TARGETS = get_config_value("max_concurrent_targets", "TELEGRAM_MAX_CONCURRENT_TARGETS", is_int=True, default_val=MAX_CONCURRENT_TARGETS)
+
+    # Optional list of targets: [{"group_id": -100..., "topic_id": 123}, {"group_id": -100...}]
+    TARGETS = []
+    for target in config.get("targets") or []:
+        try:
+            TARGETS.append((int(target["group_id"]), int(target["topic_id"]) if target.get("topic_id") is not None else None))
+        except (KeyError, TypeError, ValueError):
+            logger.error(f"Ignoring invalid entry in 'targets' of {CONFIG_FILE}: {target}")
+            print(f"⚠️ Ignoring invalid target in {CONFIG_FILE}: {target}")
+
+    # Optional additional accounts for sharded scraping: ["session_b", {"name": "session_c", "phone": "+48..."}]
+    SESSIONS = []
+    for session in config.get("sessions") or []:
+        if isinstance(session, str):
+            session = {"name": session}
+        if not isinstance(session, dict) or not session.get("name"):
+            logger.error(f"Ignoring invalid entry in 'sessions' of {CONFIG_FILE}: {session}")
+            print(f"⚠️ Ignoring invalid session in {CONFIG_FILE}: {session}")
+            continue
+        SESSIONS.append({'name': str(session["name"]), 'phone': session.get("phone")})
+
     logger.info("Configuration loaded.")
 
 # Script Configuration
 BATCH_SIZE = 100
 DOWNLOAD_MEDIA = True
-CHUNK_SIZE = 1048576  # 1MB
+TABULAR_COLUMNS = ['id', 'date', 'sender_id', 'sender_username', 'sender_first_name', 'sender_last_name',
+                   'text', 'has_media', 'media_filename', 'has_links', 'reply_to_message_id', 'edit_date', 'deleted']
+CHUNK_SIZE = 1048576  # 1MB, size of one part of a large-file download
 MAX_RETRIES = 3
-MAX_MEDIA_SIZE = 100 * 1024 * 1024 # 100MB
+MAX_MEDIA_SIZE = 1024 * 1024 * 1024 # 1GB (large files are downloaded in resumable parts)
+LARGE_FILE_THRESHOLD = 10 * 1024 * 1024 # Documents above 10MB use the parallel part downloader
+DOWNLOAD_REQUEST_SIZE = 512 * 1024 # Bytes per upload.getFile request (Telegram's maximum)
+DOWNLOAD_PART_WORKERS = 4 # Parts of one large file fetched concurrently
+MEDIA_DOWNLOAD_WORKERS = 4 # Concurrent media downloads (overridable with --media_workers)
+MEDIA_QUEUE_SIZE = 200 # Pending downloads before message iteration waits for the workers
+MEDIA_STORE_DIR = OUTPUT_DIR / "media_store" # Downloaded files, shared by all archives
+SHARD_SLICES_PER_SESSION = 4 # ID slices per session when sharding, so faster sessions take over more of the work
+SHARD_MIN_SLICE_IDS = 5000 # Ranges are not split into slices smaller than this many message IDs
+SYNC_WINDOW_MESSAGES = 1000 # Newest archived messages re-checked by --sync_edits (overridable with --sync_window)
+SYNC_SAMPLE_BLOCK = 100 # Consecutive archived messages per sampled block of --sync_edits (one request each)
+MAX_OPEN_TOPIC_ARCHIVES = 32 # --split_topics archives with an open writer; the least recently written is closed
+THUMBNAIL_DIR_NAME = "thumbs" # Next to media/ in each archive directory
+THUMBNAIL_SIZE = 320 # Longest side of a thumbnail or video poster, in pixels
+THUMBNAIL_WORKERS = os.cpu_count() or 2 # Processes generating thumbnails
+THUMBNAIL_IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'webp')
+THUMBNAIL_VIDEO_EXTENSIONS = ('mp4', 'webm', 'mov')
+FOLLOW_FLUSH_INTERVAL = 2.0 # Seconds between batched appends (one fsync per archive) in --follow mode
+
+media_store_locks = {} # Store key -> {'lock': asyncio.Lock held while that object is downloaded, 'users': tasks using it}
+
+# Rate limiting: every Telegram request goes through the limiter of its class
+FLOOD_RATE_DECREASE = 0.5 # Rate multiplier after a FloodWaitError
+FLOOD_RATE_INCREASE = 1.2 # Rate multiplier after RATE_RECOVERY_INTERVAL seconds without one
+RATE_RECOVERY_INTERVAL = 60
+HISTORY_PAGE_SIZE = 100 # Messages per GetHistoryRequest issued by iter_messages()
+
+class AdaptiveRateLimiter:
+    """Token bucket for one class of Telegram requests that adapts to FloodWaitError.
+
+    A FloodWaitError pauses every caller of the class for the requested time and
+    halves the rate; after RATE_RECOVERY_INTERVAL seconds without one the rate
+    grows again, up to max_rate. Time spent waiting is accumulated for reporting.
+    """
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = rate
+        self.min_rate = rate / 16
+        self.max_rate = rate * 4
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.last_rate_change = time.monotonic()
+        self.requests = 0
+        self.flood_waits = 0
+        self.throttled_seconds = 0.0 # Waiting for a token
+        self.flood_wait_seconds = 0.0 # Paused by FloodWaitError
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.requests += 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                    self.throttled_seconds += wait
+                await asyncio.sleep(wait)
+
+    def on_success(self):
+        now = time.monotonic()
+        if self.rate < self.max_rate and now - self.last_rate_change >= RATE_RECOVERY_INTERVAL:
+            self.rate = min(self.max_rate, self.rate * FLOOD_RATE_INCREASE)
+            self.last_rate_change = now
+            logger.debug(f"Rate limiter '{self.name}' speeding up to {self.rate:.2f} req/s")
+
+    async def on_flood_wait(self, seconds):
+        now = time.monotonic()
+        new_pause = now + seconds
+        if new_pause > self.paused_until:
+            # Concurrent callers hitting the same wait only extend the pause, never add it up
+            self.flood_wait_seconds += new_pause - max(now, self.paused_until)
+            self.paused_until = new_pause
+        self.flood_waits += 1
+        self.rate = max(self.min_rate, self.rate * FLOOD_RATE_DECREASE)
+        self.tokens = 0
+        self.last_rate_change = now
+        logger.warning(f"API flood limit reached ({self.name}). Waiting {seconds} seconds, rate lowered to {self.rate:.2f} req/s.")
+        print(f"⏳ API flood limit reached ({self.name}). Waiting {seconds} seconds...")
+        await asyncio.sleep(max(0, self.paused_until - now))
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'flood_waits': self.flood_waits,
+            'throttled_seconds': round(self.throttled_seconds, 1),
+            'flood_wait_seconds': round(self.flood_wait_seconds, 1),
+            'rate': round(self.rate, 2)
+        }
+
+def new_rate_limiters():
+    """Returns a fresh set of limiters, one per request class. Each Telegram account gets its own set."""
+    return {
+        'history': AdaptiveRateLimiter('history', rate=2.0, burst=5), # Message history pages
+        'users': AdaptiveRateLimiter('users', rate=2.0, burst=5), # get_entity() lookups
+        'media': AdaptiveRateLimiter('media', rate=10.0, burst=10) # Downloads and file parts
+    }
+
+RATE_LIMITERS = new_rate_limiters() # Limiters of the main session
+SESSION_RATE_LIMITERS = {} # Session name -> limiters of an additional session (sharded scraping)
+# Limiters used by call_telegram() in the current task; unset means the main session's
+current_rate_limiters = contextvars.ContextVar('current_rate_limiters', default=None)
+
+def get_rate_limiter(request_class):
+    """Returns the limiter of request_class for the session the current task talks to."""
+    return (current_rate_limiters.get() or RATE_LIMITERS)[request_class]
+
+async def call_telegram(request_class, func, *args, **kwargs):
+    """Awaits func(*args, **kwargs) under the rate limiter of request_class, retrying after FloodWaitError."""
+    limiter = get_rate_limiter(request_class)
+    while True:
+        await limiter.acquire()
+        try:
+            result = await func(*args, **kwargs)
+        except FloodWaitError as e:
+            await limiter.on_flood_wait(e.seconds)
+            continue
+        limiter.on_success()
+        return result
+
+async def iter_history(current_client, entity, **kwargs):
+    """iter_messages() with one 'history' token per page, resuming after FloodWaitError."""
+    limiter = get_rate_limiter('history')
+    offset_id = kwargs.pop('offset_id', 0)
+    while True:
+        await limiter.acquire()
+        try:
+            count = 0
+            async for msg in current_client.iter_messages(entity, offset_id=offset_id, **kwargs):
+                yield msg
+                offset_id = msg.id # Continue past the last message after a FloodWaitError
+                count += 1
+                if count % HISTORY_PAGE_SIZE == 0:
+                    limiter.on_success()
+                    await limiter.acquire()
+            limiter.on_success()
+            return
+        except FloodWaitError as e:
+            await limiter.on_flood_wait(e.seconds)
+
+def all_rate_limiters():
+    """Returns every limiter by name; those of additional sessions are named 'class@session'."""
+    limiters = dict(RATE_LIMITERS)
+    for session_name, session_limiters in SESSION_RATE_LIMITERS.items():
+        for name, limiter in session_limiters.items():
+            limiters[f"{name}@{session_name}"] = limiter
+    return limiters
+
+def throttle_summary():
+    """Returns the statistics of all rate limiters and the total time spent throttled."""
+    limiters = all_rate_limiters()
+    per_class = {name: limiter.stats() for name, limiter in limiters.items()}
+    total = sum(l.throttled_seconds + l.flood_wait_seconds for l in limiters.values())
+    return {'total_seconds': round(total, 1), 'classes': per_class}
+
+# Run metrics: each run_scraper() call records into its own RunMetrics, reachable from
+# any coroutine of that run (including media workers) through current_metrics.
+current_metrics = contextvars.ContextVar('current_metrics', default=None)
+METRICS_HOST = "127.0.0.1" # Address of the --metrics_port server (overridable with --metrics_host)
+ACTIVE_METRICS = {} # Target label -> RunMetrics of the latest run, read by the Prometheus endpoint
+
+class RunMetrics:
+    """Per-stage timings (seconds) and counters of one scraper run."""
+
+    def __init__(self, target):
+        self.target = target
+        self.started_at = time.time()
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - started
+
+    def add(self, counter, amount=1):
+        self.counters[counter] += amount
+
+    def to_dict(self):
+        return {
+            'target': self.target,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(),
+            'elapsed_seconds': round(time.time() - self.started_at, 3),
+            'stage_seconds': {name: round(seconds, 3) for name, seconds in sorted(self.stages.items())},
+            'counters': dict(sorted(self.counters.items())),
+            'throttling': throttle_summary()
+        }
+
+def metrics_add(counter, amount=1):
+    """Adds to a counter of the current run, if any."""
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.add(counter, amount)
+
+@contextmanager
+def metrics_stage(name):
+    """Times a block as a stage of the current run, if any."""
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+    else:
+        with metrics.stage(name):
+            yield
+
+async def timed_iteration(async_iterable, stage_name):
+    """Yields from async_iterable, counting the time spent waiting for items as a stage."""
+    iterator = async_iterable.__aiter__()
+    while True:
+        with metrics_stage(stage_name):
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        yield item
+
+def prometheus_metrics_text():
+    """Renders the metrics of all runs of this process in the Prometheus text format."""
+    lines = [
+        "# TYPE gramscrap_stage_seconds_total counter",
+        "# TYPE gramscrap_events_total counter",
+        "# TYPE gramscrap_throttled_seconds_total counter",
+        "# TYPE gramscrap_flood_waits_total counter",
+        "# TYPE gramscrap_rate_limit gauge"
+    ]
+    for target, metrics in list(ACTIVE_METRICS.items()):
+        for name, seconds in list(metrics.stages.items()):
+            lines.append(f'gramscrap_stage_seconds_total{{target="{target}",stage="{name}"}} {seconds:.3f}')
+        for name, value in list(metrics.counters.items()):
+            lines.append(f'gramscrap_events_total{{target="{target}",event="{name}"}} {value}')
+    for name, limiter in all_rate_limiters().items():
+        lines.append(f'gramscrap_throttled_seconds_total{{class="{name}",reason="rate"}} {limiter.throttled_seconds:.3f}')
+        lines.append(f'gramscrap_throttled_seconds_total{{class="{name}",reason="flood_wait"}} {limiter.flood_wait_seconds:.3f}')
+        lines.append(f'gramscrap_flood_waits_total{{class="{name}"}} {limiter.flood_waits}')
+        lines.append(f'gramscrap_rate_limit{{class="{name}"}} {limiter.rate:.3f}')
+    return "\n".join(lines) + "\n"
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_metrics_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Keep scrapes of /metrics out of the console
+
+def start_metrics_server(port, host=METRICS_HOST):
+    """Serves /metrics in the Prometheus text format from a background thread."""
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Prometheus metrics on http://{host}:{port}/metrics")
+    return server
 
 client = None # Initialize globally, will be set after config load and arg parsing
+extra_sessions = [] # Additional sessions ({'name', 'phone', 'client'}, plus 'lock' once used) for sharded scraping
+
+USER_CACHE_FILE = OUTPUT_DIR / "user_cache.json" # Shared by all runs and targets
+USER_CACHE_TTL = 7 * 24 * 3600 # Re-resolve cached users after a week
+USER_BATCH_SIZE = 100 # IDs per get_entity() call (GetUsersRequest accepts up to 200)
 
-# User cache
+# User cache: user_id -> {'username', 'first_name', 'last_name', 'fetched_at'}
+# Entries without 'fetched_at' are error placeholders kept only for the current process.
 user_cache = {}
+user_cache_loaded = False
 
-async def get_users_info(current_client, user_ids):
-    # Filter only users not in cache
-    new_user_ids = [uid for uid in user_ids if uid not in user_cache and uid is not None] # Ensure uid is not None
-    
-    cached_users = {uid: user_cache[uid] for uid in user_ids if uid in user_cache}
-    
-    if not new_user_ids:
-        # logger.debug("All requested users are already in cache or None.")
-        return {uid: user_cache.get(uid, {'username': None, 'first_name': 'Unknown/Deleted', 'last_name': None}) for uid in user_ids}
-    
-    users_info_from_api = {}
+UNKNOWN_USER = {'username': None, 'first_name': 'Unknown/Deleted', 'last_name': None}
+ERROR_USER = {'username': None, 'first_name': 'ErrorFetching', 'last_name': None}
+
+def load_user_cache():
+    """Loads the persistent user cache from USER_CACHE_FILE into user_cache (once per process)."""
+    global user_cache_loaded
+    if user_cache_loaded:
+        return
+    user_cache_loaded = True
+    if not USER_CACHE_FILE.exists():
+        return
+    try:
+        with open(USER_CACHE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for uid_str, user_data in data.items():
+            user_cache[int(uid_str)] = user_data
+        logger.info(f"Loaded {len(data)} cached users from {USER_CACHE_FILE}")
+    except Exception as e:
+        logger.warning(f"Could not load user cache {USER_CACHE_FILE}: {e}. Starting with an empty cache.")
+
+def save_user_cache():
+    """Atomically writes the resolved (non-error) entries of user_cache to USER_CACHE_FILE."""
+    data = {str(uid): user_data for uid, user_data in user_cache.items() if 'fetched_at' in user_data}
+    try:
+        os.makedirs(USER_CACHE_FILE.parent, exist_ok=True)
+        tmp_path = USER_CACHE_FILE.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, USER_CACHE_FILE)
+    except Exception as e:
+        logger.error(f"Error writing user cache {USER_CACHE_FILE}: {e}")
+
+def is_user_cached(user_id):
+    """True if user_id has a cache entry that has not expired."""
+    user_data = user_cache.get(user_id)
+    if user_data is None:
+        return False
+    fetched_at = user_data.get('fetched_at')
+    return fetched_at is None or time.time() - fetched_at < USER_CACHE_TTL
+
+def cache_user_entity(user_id, user):
+    """Stores the name fields of a resolved Telethon entity in user_cache and returns them."""
+    user_data = {
+        'username': getattr(user, 'username', None),
+        'first_name': getattr(user, 'first_name', None),
+        'last_name': getattr(user, 'last_name', None),
+        'fetched_at': time.time()
+    }
+    user_cache[user_id] = user_data
+    return user_data
+
+def remember_sender(msg):
+    """Caches the sender entity Telethon already attached to an iter_messages() result, if any."""
+    if msg.sender_id and msg.sender is not None and not is_user_cached(msg.sender_id):
+        cache_user_entity(msg.sender_id, msg.sender)
+        metrics_add('users_from_messages')
+
+async def fetch_single_user(current_client, user_id):
+    """Resolves one user with get_entity(), caching either the result or an error placeholder."""
+    try:
+        user = await call_telegram('users', current_client.get_entity, user_id)
+        return cache_user_entity(user_id, user)
+    except TypeError as e:
+        if "NoneType" in str(e): # Handle cases like "Cannot cast NoneType to any kind of Peer"
+            logger.warning(f"Could not fetch info for user_id {user_id} (likely deleted or system message): {str(e)}")
+            user_data = dict(UNKNOWN_USER)
+        else:
+            logger.error(f"TypeError fetching user info for {user_id}: {str(e)}")
+            user_data = dict(ERROR_USER)
+    except Exception as e:
+        logger.error(f"Error fetching user info for {user_id}: {str(e)}")
+        user_data = dict(ERROR_USER)
+    user_cache[user_id] = user_data # Cache error state for this process only
+    return user_data
+
+async def fetch_users_batch(current_client, user_ids):
+    """Resolves a batch of user IDs with one get_entity() call, falling back to one call per ID."""
     try:
+        users = await call_telegram('users', current_client.get_entity, user_ids)
+        for user_id, user in zip(user_ids, users):
+            cache_user_entity(user_id, user)
+        return
+    except Exception as e:
+        # A single unresolvable ID fails the whole batch; resolve the IDs individually instead
+        logger.debug(f"Batch user lookup failed ({e}), resolving {len(user_ids)} users individually.")
+    for user_id in user_ids:
+        await fetch_single_user(current_client, user_id)
+
+async def get_users_info(current_client, user_ids):
+    """Returns user info for user_ids, resolving only uncached or expired IDs, in batches."""
+    user_ids = [uid for uid in dict.fromkeys(user_ids) if uid is not None] # Deduplicate, keep order
+    new_user_ids = [uid for uid in user_ids if not is_user_cached(uid)]
+    metrics_add('user_cache_hits', len(user_ids) - len(new_user_ids))
+    metrics_add('user_cache_misses', len(new_user_ids))
+
+    if new_user_ids:
         if len(new_user_ids) > 10:
             print(f"👥 Fetching info for {len(new_user_ids)} new users...")
-        # logger.debug(f"Fetching information for {len(new_user_ids)} new users: {new_user_ids}")
-        
-        for user_id in new_user_ids:
-            if user_id is None: # Should be filtered by now, but as a safeguard
-                users_info_from_api[user_id] = {'username': None, 'first_name': 'N/A', 'last_name': None}
-                continue
-            try:
-                user = await current_client.get_entity(user_id)
-                user_data = {
-                    'username': user.username if hasattr(user, 'username') else None,
-                    'first_name': user.first_name if hasattr(user, 'first_name') else None,
-                    'last_name': user.last_name if hasattr(user, 'last_name') else None
-                }
-                user_cache[user_id] = user_data
-                users_info_from_api[user_id] = user_data
-            except FloodWaitError as e:
-                logger.warning(f"API flood limit reached. Waiting {e.seconds} seconds.")
-                print(f"⏳ API flood limit reached. Waiting {e.seconds} seconds...")
-                await asyncio.sleep(e.seconds)
-                # Retry fetching this user_id after waiting
-                # This is a simplified retry; a more robust solution might re-add to a queue
+        with metrics_stage('users'):
+            for i in range(0, len(new_user_ids), USER_BATCH_SIZE):
+                await fetch_users_batch(current_client, new_user_ids[i:i + USER_BATCH_SIZE])
+
+    return {uid: user_cache.get(uid, UNKNOWN_USER) for uid in user_ids}
+
+
+def media_store_key(media):
+    """Returns the store key of a photo/document ('photo_<id>' / 'doc_<id>'), or None.
+
+    Telegram photo and document IDs are globally unique, so the same file reposted
+    in another message, topic or group maps to the same key.
+    """
+    photo = getattr(media, 'photo', None)
+    if photo is not None and getattr(photo, 'id', None):
+        return f"photo_{photo.id}"
+    document = getattr(media, 'document', None)
+    if document is not None and getattr(document, 'id', None):
+        return f"doc_{document.id}"
+    return None
+
+def media_store_path(name):
+    """Path of an object in MEDIA_STORE_DIR, sharded by the last two characters of its stem."""
+    stem = name.split('.')[0]
+    return MEDIA_STORE_DIR / stem[-2:] / name
+
+def link_media_object(object_path, filepath):
+    """Makes object_path available at filepath: hardlink if possible, copy otherwise."""
+    try:
+        os.link(object_path, filepath)
+    except FileExistsError:
+        pass
+    except OSError: # Different filesystem or no hardlink support
+        shutil.copy2(object_path, filepath)
+
+def is_complete_object(object_path, expected_size):
+    """True if object_path exists and matches the expected size (when it is known)."""
+    if not object_path.exists():
+        return False
+    return not expected_size or object_path.stat().st_size == expected_size
+
+def load_part_bitmap(bitmap_path, file_size, part_count):
+    """Returns the bytearray of completed parts from a sidecar file (all zero if unusable)."""
+    if bitmap_path.exists():
+        try:
+            with open(bitmap_path, 'r', encoding='utf-8') as f:
+                sidecar = json.load(f)
+            if sidecar.get('size') == file_size and sidecar.get('part_size') == CHUNK_SIZE:
+                return bytearray.fromhex(sidecar['done'])
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable part bitmap {bitmap_path}: {e}")
+    return bytearray(part_count)
+
+async def download_large_file(current_client, document, filepath, file_size):
+    """Downloads a document in CHUNK_SIZE parts fetched concurrently into a preallocated file.
+
+    Finished parts are recorded in a '<file>.parts.json' sidecar, so an interrupted
+    download resumes with the missing parts only. Returns True once the file is complete.
+    """
+    filepath = Path(filepath)
+    bitmap_path = filepath.with_name(filepath.name + '.parts.json')
+    part_count = (file_size + CHUNK_SIZE - 1) // CHUNK_SIZE
+    done = load_part_bitmap(bitmap_path, file_size, part_count)
+    if not filepath.exists() or filepath.stat().st_size != file_size:
+        done = bytearray(part_count) # Parts on disk are only trusted together with the bitmap
+        with open(filepath, 'wb') as f:
+            f.truncate(file_size) # Preallocate (sparse where supported)
+
+    missing_parts = [i for i in range(part_count) if not done[i]]
+    if len(missing_parts) < part_count:
+        print(f"⏯️ Resuming {filepath.name}: {part_count - len(missing_parts)}/{part_count} parts already downloaded")
+
+    parts_since_save = [0]
+
+    def save_bitmap():
+        parts_since_save[0] = 0
+        f.flush()
+        os.fsync(f.fileno()) # Part data must be on disk before the bitmap claims it
+        archive_store.write_json_atomic(bitmap_path, {'size': file_size, 'part_size': CHUNK_SIZE, 'done': done.hex()})
+
+    part_queue = asyncio.Queue()
+    for part in missing_parts:
+        part_queue.put_nowait(part)
+
+    async def part_worker():
+        limiter = get_rate_limiter('media')
+        while not part_queue.empty():
+            part = part_queue.get_nowait()
+            offset = part * CHUNK_SIZE
+            part_length = min(CHUNK_SIZE, file_size - offset)
+            attempt = 0
+            while attempt < MAX_RETRIES:
+                await limiter.acquire()
                 try:
-                    user = await current_client.get_entity(user_id)
-                    user_data = {
-                        'username': user.username if hasattr(user, 'username') else None,
-                        'first_name': user.first_name if hasattr(user, 'first_name') else None,
-                        'last_name': user.last_name if hasattr(user, 'last_name') else None
-                    }
-                    user_cache[user_id] = user_data
-                    users_info_from_api[user_id] = user_data
-                except Exception as ex_retry:
-                    logger.error(f"Error fetching user info for {user_id} after FloodWait: {str(ex_retry)}")
-                    user_data = {'username': None, 'first_name': 'ErrorFetching', 'last_name': None}
-                    user_cache[user_id] = user_data # Cache error state
-                    users_info_from_api[user_id] = user_data
-            except TypeError as e:
-                if "NoneType" in str(e): # Handle cases like "Cannot cast NoneType to any kind of Peer"
-                    logger.warning(f"Could not fetch info for user_id {user_id} (likely deleted or system message): {str(e)}")
-                    user_data = {'username': None, 'first_name': 'Unknown/Deleted', 'last_name': None}
-                else:
-                    logger.error(f"TypeError fetching user info for {user_id}: {str(e)}")
-                    user_data = {'username': None, 'first_name': 'ErrorFetching', 'last_name': None}
-                user_cache[user_id] = user_data # Cache error state
-                users_info_from_api[user_id] = user_data
-            except Exception as e:
-                logger.error(f"Error fetching user info for {user_id}: {str(e)}")
-                # Provide a default structure for users that cause errors
-                user_data = {'username': None, 'first_name': 'ErrorFetching', 'last_name': None}
-                user_cache[user_id] = user_data # Cache error state
-                users_info_from_api[user_id] = user_data
-            
-        # logger.debug(f"Stored {len(users_info_from_api)} new users in cache.")
-        # Combine cached users with newly fetched ones
-        final_user_info = cached_users
-        final_user_info.update(users_info_from_api)
-        # Ensure all original user_ids have an entry, even if it's a default for None
-        for uid in user_ids:
-            if uid not in final_user_info:
-                 final_user_info[uid] = {'username': None, 'first_name': 'Unknown/Deleted', 'last_name': None}
-        return final_user_info
-        
-    except FloodWaitError as e: # Outer FloodWait, e.g. when calling get_entity too rapidly in a loop
-        logger.warning(f"API flood limit reached during user info batch. Waiting {e.seconds} seconds.")
-        print(f"⏳ API flood limit reached. Waiting {e.seconds} seconds...")
-        await asyncio.sleep(e.seconds)
-        return await get_users_info(current_client, user_ids) # Retry the whole batch
-    except Exception as e:
-        logger.error(f"General error fetching user information: {str(e)}")
-        # Return default for all requested user_ids in case of a general failure
-        return {uid: {'username': None, 'first_name': 'ErrorFetching', 'last_name': None} for uid in user_ids}
+                    position = offset
+                    async for chunk in current_client.iter_download(
+                            document, offset=offset, request_size=DOWNLOAD_REQUEST_SIZE,
+                            limit=(part_length + DOWNLOAD_REQUEST_SIZE - 1) // DOWNLOAD_REQUEST_SIZE,
+                            file_size=file_size):
+                        chunk = chunk[:offset + part_length - position]
+                        # No await between seek and write, so concurrent parts cannot interleave
+                        f.seek(position)
+                        f.write(chunk)
+                        position += len(chunk)
+                    if position - offset != part_length:
+                        raise IOError(f"part {part} returned {position - offset} of {part_length} bytes")
+                    limiter.on_success()
+                    metrics_add('bytes_downloaded', part_length)
+                    done[part] = 1
+                    parts_since_save[0] += 1
+                    if parts_since_save[0] >= 8:
+                        save_bitmap()
+                    break
+                except FloodWaitError as e:
+                    await limiter.on_flood_wait(e.seconds) # Not counted as a failed attempt
+                except Exception as e:
+                    attempt += 1
+                    metrics_add('part_retries')
+                    logger.warning(f"Error downloading part {part} of {filepath.name} (attempt {attempt}): {e}")
+                    await asyncio.sleep(1)
+
+    with open(filepath, 'r+b') as f:
+        workers = [asyncio.create_task(part_worker()) for _ in range(DOWNLOAD_PART_WORKERS)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            save_bitmap()
 
+    if all(done):
+        os.remove(bitmap_path)
+        return True
+    logger.warning(f"Incomplete download of {filepath.name}: {part_count - sum(done)} of {part_count} parts missing")
+    return False
+
+async def fetch_media_object(current_client, msg, file_extension, expected_size):
+    """Returns the media store path holding msg's media, downloading it only if it is not stored yet."""
+    key = media_store_key(msg.media)
+    if key is None:
+        return await fetch_media_object_by_content(current_client, msg, file_extension)
+
+    object_path = media_store_path(f"{key}.{file_extension}")
+    # Two queued messages can carry the same file; only one of them downloads it
+    entry = media_store_locks.setdefault(key, {'lock': asyncio.Lock(), 'users': 0})
+    entry['users'] += 1
+    try:
+        async with entry['lock']:
+            if is_complete_object(object_path, expected_size):
+                logger.debug(f"Media {key} already in store, skipping download (message ID: {msg.id})")
+                metrics_add('media_store_hits')
+                return object_path
+            metrics_add('media_store_misses')
+            os.makedirs(object_path.parent, exist_ok=True)
+            tmp_path = object_path.with_name(object_path.name + '.part')
+            document = getattr(msg.media, 'document', None)
+            if document is not None and expected_size > LARGE_FILE_THRESHOLD:
+                if not await download_large_file(current_client, document, tmp_path, expected_size):
+                    return None # The .part file and its part bitmap are kept for the next attempt
+            else:
+                await call_telegram('media', current_client.download_media, msg.media, str(tmp_path))
+                if tmp_path.exists():
+                    metrics_add('bytes_downloaded', tmp_path.stat().st_size)
+            if not tmp_path.exists():
+                return None
+            os.replace(tmp_path, object_path)
+            return object_path
+    finally:
+        # Dropped only when no task waits for it: a waiter about to take over the lock
+        # must not see a second lock, and a second download, appear for the same key
+        entry['users'] -= 1
+        if entry['users'] == 0:
+            media_store_locks.pop(key, None)
+
+async def fetch_media_object_by_content(current_client, msg, file_extension):
+    """Downloads media without a photo/document ID and stores it under its SHA-256."""
+    os.makedirs(MEDIA_STORE_DIR, exist_ok=True)
+    tmp_path = MEDIA_STORE_DIR / f"tmp_{msg.id}_{int(time.time()*1000)}.part"
+    await call_telegram('media', current_client.download_media, msg.media, str(tmp_path))
+    if not tmp_path.exists():
+        return None
+    metrics_add('bytes_downloaded', tmp_path.stat().st_size)
+    sha256 = hashlib.sha256()
+    with open(tmp_path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(block)
+    object_path = media_store_path(f"sha256_{sha256.hexdigest()}.{file_extension}")
+    if object_path.exists():
+        os.remove(tmp_path)
+    else:
+        os.makedirs(object_path.parent, exist_ok=True)
+        os.replace(tmp_path, object_path)
+    return object_path
 
 async def download_media_file(current_client, msg, media_path_base):
     if not msg.media:
@@ -254,9 +804,9 @@ async def download_media_file(current_client, msg, media_path_base):
             if file_extension in ['exe', 'bat', 'cmd', 'msi', 'dll', 'sys', 'sh', 'js']:
                 file_extension = f"unsafe_{file_extension}"
 
-        # Generate a unique filename
-        timestamp_part = int(time.time()*1000) # Milliseconds for more uniqueness
-        unique_filename_base = f"{msg.id}_{timestamp_part}"
+        # Filenames are derived from the message ID only, so a file that is already in
+        # this archive's media/ directory is recognised on later runs
+        unique_filename_base = f"{msg.id}"
         
         # Try to use original filename if available and safe
         final_filename_to_save = f"{unique_filename_base}.{file_extension}"
@@ -275,14 +825,14 @@ async def download_media_file(current_client, msg, media_path_base):
         if os.path.exists(filepath):
             logger.debug(f"File already exists: {final_filename_to_save}")
             return final_filename_to_save
-            
-        await current_client.download_media(msg.media, filepath)
+
+        object_path = await fetch_media_object(current_client, msg, file_extension, file_size)
+        if object_path:
+            link_media_object(object_path, filepath)
         
         if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-            # logger.debug(f"Downloaded: {final_filename_to_save}")
             return final_filename_to_save
         elif os.path.exists(filepath) and file_size == 0 and os.path.getsize(filepath) == 0: # Case of 0-byte file
-             # logger.debug(f"Downloaded 0-byte file: {final_filename_to_save}")
              return final_filename_to_save
         else:
             logger.warning(f"Failed to download or file is empty: {final_filename_to_save} (Message ID: {msg.id})")
@@ -297,33 +847,603 @@ async def download_media_file(current_client, msg, media_path_base):
         logger.error(f"Error downloading media for message {msg.id}: {str(e)}")
         return None
 
+def media_descriptor(media):
+    """Returns the fields needed to download a photo/document later: type, ID, size, MIME type and file name."""
+    photo = getattr(media, 'photo', None)
+    if photo is not None and getattr(photo, 'id', None):
+        # Progressive JPEG sizes list their scan sizes; the largest one is the full photo
+        sizes = [getattr(size, 'size', None) or max(getattr(size, 'sizes', None) or [0]) for size in getattr(photo, 'sizes', None) or []]
+        return {'media_type': 'photo', 'media_id': photo.id, 'media_size': max(sizes, default=0) or None,
+                'media_mime_type': 'image/jpeg', 'media_file_name': None}
+    document = getattr(media, 'document', None)
+    if document is not None and getattr(document, 'id', None):
+        file_name = next((attr.file_name for attr in getattr(document, 'attributes', None) or [] if hasattr(attr, 'file_name')), None)
+        return {'media_type': 'document', 'media_id': document.id, 'media_size': getattr(document, 'size', None),
+                'media_mime_type': getattr(document, 'mime_type', None), 'media_file_name': file_name}
+    return {}
+
+def message_topic_id(msg):
+    """Returns the forum topic (ID of the topic's first message) a message was posted in, or None."""
+    if isinstance(getattr(msg, 'action', None), MessageActionTopicCreate):
+        return msg.id # The service message that opened the topic
+    reply_to = getattr(msg, 'reply_to', None)
+    if reply_to is None or not getattr(reply_to, 'forum_topic', False):
+        return None
+    return getattr(reply_to, 'reply_to_top_id', None) or reply_to.reply_to_msg_id
+
+def build_message_data(msg, user_data, media_filename):
+    """Builds the archive record for a Telethon message."""
+    record = {
+        'id': msg.id,
+        'date': msg.date.isoformat() if msg.date else None, # Store in ISO format
+        'sender_id': msg.sender_id,
+        'sender_username': user_data.get('username'),
+        'sender_first_name': user_data.get('first_name'),
+        'sender_last_name': user_data.get('last_name'),
+        'text': msg.text.replace('\\n', ' ') if msg.text else '', # Normalize newlines
+        'has_media': bool(msg.media),
+        'media_filename': media_filename, # Can be None, actual filename, or "skipped..."
+        'has_links': 'http' in msg.text if msg.text else False, # Basic link detection
+        'reply_to_message_id': msg.reply_to_msg_id if msg.reply_to and msg.reply_to.reply_to_msg_id else None,
+        'topic_id': message_topic_id(msg), # Forum topic, None outside forum groups
+        'edit_date': msg.edit_date.isoformat() if getattr(msg, 'edit_date', None) else None # Compared by --sync_edits
+    }
+    # Rendered once here, so the viewer and the export do not format on every request
+    record['text_html'] = message_format.render_text_html(record['text'])
+    record['text_html_version'] = message_format.FORMAT_VERSION
+    if msg.media:
+        record.update(media_descriptor(msg.media)) # Lets --backfill_media download it later
+    return record
+
+async def media_download_worker(current_client, media_queue, media_dir):
+    """Downloads queued media and fills media_filename into the queued message record."""
+    while True:
+        item = await media_queue.get()
+        if item is None: # Sentinel: no more media will be queued
+            media_queue.task_done()
+            return
+        msg, message_data = item
+        try:
+            media_filename = None
+            with metrics_stage('media_download'): # Summed over all workers
+                for attempt in range(MAX_RETRIES):
+                    media_filename = await download_media_file(current_client, msg, media_dir)
+                    if media_filename: # Includes "skipped_large_file" string
+                        break # Break from retry loop if media processed (downloaded, skipped, or failed definitively by download_media_file)
+                    metrics_add('media_retries')
+                    await asyncio.sleep(1) # Wait before retrying
+            message_data['media_filename'] = media_filename
+            metrics_add('media_skipped_large' if media_filename and media_filename.startswith('skipped_large_file') else
+                        'media_files' if media_filename else 'media_failed')
+        except Exception as e:
+            logger.error(f"Media worker error for message {msg.id}: {str(e)}")
+        finally:
+            media_queue.task_done()
+        # Not reached when the worker is cancelled, so an interrupted download
+        # leaves the record unwritten and it is fetched again on the next run.
+        message_data.pop('_media_pending', None)
+
+async def connect_and_authorize(current_client=None, phone=None, session_name=None):
+    """Connects a client (the global one by default) and signs in if its session is not authorized yet."""
+    current_client = current_client or client
+    phone = phone or (None if session_name else PHONE) # Additional sessions belong to other accounts
+    if not current_client.is_connected():
+        print("📡 Connecting to Telegram...")
+        await current_client.connect()
+
+    if not await current_client.is_user_authorized():
+        print("🔐 Authorization required" + (f" for session '{session_name}'" if session_name else ""))
+        if not phone:
+            phone = input(f"📞 Phone number of session '{session_name}': ")
+        await current_client.send_code_request(phone)
+        code = input('📱 Enter SMS code: ')
+        try:
+            await current_client.sign_in(phone, code)
+            print("✅ Successfully logged in")
+        except SessionPasswordNeededError:
+            password = input('🔑 Enter 2FA password: ')
+            await current_client.sign_in(password=password)
+            print("✅ Successfully logged in with 2FA")
+
+async def resolve_entity(current_client, group_id):
+    """get_entity() for group_id, loading the dialogs first if this session has not seen the group yet."""
+    try:
+        return await call_telegram('users', current_client.get_entity, group_id)
+    except ValueError:
+        # Access hashes are per account: a fresh session only knows the chats from its dialog list
+        await call_telegram('users', current_client.get_dialogs)
+        return await call_telegram('users', current_client.get_entity, group_id)
+
+def split_id_range(min_id, max_id, parts):
+    """Splits the exclusive ID range (min_id, max_id) into up to `parts` consecutive ranges, newest first."""
+    span = max_id - min_id - 1 # Number of IDs in the range
+    parts = max(1, min(parts, span // SHARD_MIN_SLICE_IDS))
+    points = [min_id + span * i // parts for i in range(parts + 1)]
+    return [(points[i], points[i + 1] + 1) for i in reversed(range(parts))]
+
+async def shard_id_ranges(current_client, entity, id_ranges, parts, reply_to=None):
+    """Splits missing ID ranges into about `parts` slices for sharded scraping, newest first.
+
+    The open-ended range above the high-water mark is bounded by the newest message
+    first; its newest slice stays open-ended, so messages posted meanwhile are included.
+    """
+    bounded = [] # (min_id, max_id, open_ended)
+    for min_id, max_id in id_ranges:
+        if max_id is None:
+            newest_id = None
+            async for msg in iter_history(current_client, entity, limit=1, reply_to=reply_to):
+                newest_id = msg.id
+            if newest_id is None or newest_id <= min_id:
+                continue # Nothing newer than the high-water mark yet
+            bounded.append((min_id, newest_id + 1, True))
+        else:
+            bounded.append((min_id, max_id, False))
+    total = sum(max_id - min_id for min_id, max_id, _ in bounded)
+    slices = []
+    for min_id, max_id, open_ended in bounded:
+        # Each range gets a share of the slices proportional to its size
+        range_slices = split_id_range(min_id, max_id, round(parts * (max_id - min_id) / total))
+        if open_ended:
+            range_slices[0] = (range_slices[0][0], None)
+        slices.extend(range_slices)
+    return slices
+
+def thumbnail_name(media_filename):
+    """Returns the thumbnail file name of a media file, or None if no thumbnail is made for its type."""
+    extension = media_filename.rsplit('.', 1)[-1].lower() if '.' in media_filename else ''
+    if extension in THUMBNAIL_IMAGE_EXTENSIONS:
+        return f"{media_filename}.webp"
+    if extension in THUMBNAIL_VIDEO_EXTENSIONS:
+        return f"{media_filename}.jpg" # Poster frame
+    return None
+
+def make_thumbnail(source_path, thumb_path, max_size=THUMBNAIL_SIZE):
+    """Writes a downscaled WebP image or a JPEG video poster frame. Runs in a worker process.
+
+    Returns True on success; unsupported or unreadable files return False.
+    """
+    tmp_path = f"{thumb_path}.part"
+    try:
+        if str(thumb_path).endswith('.webp'):
+            if Image is None:
+                return False
+            with Image.open(source_path) as image:
+                image.thumbnail((max_size, max_size)) # First frame of animated images
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+                image.save(tmp_path, 'WEBP', quality=75)
+        else:
+            if shutil.which('ffmpeg') is None:
+                return False
+            # Poster from one second in (or the first frame of shorter videos), longest side max_size
+            scale = f"scale='if(gt(iw,ih),{max_size},-2)':'if(gt(iw,ih),-2,{max_size})'"
+            for seek in ('1', '0'):
+                subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-ss', seek, '-i', str(source_path),
+                                '-frames:v', '1', '-vf', scale, '-f', 'image2', '-q:v', '5', tmp_path],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+                if os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
+                    break
+            else:
+                return False
+        os.replace(tmp_path, thumb_path)
+        return True
+    except Exception:
+        return False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+thumbnail_pool = None # ProcessPoolExecutor shared by all targets, created on first use
+
+async def generate_thumbnails(archive_dir, reuse_dir=None):
+    """Creates the missing thumbnails of an archive in a process pool and records them on the messages.
+
+    Thumbnails are written to THUMBNAIL_DIR_NAME next to media/ and their file name is
+    stored as 'thumbnail_filename'. Thumbnails already present in reuse_dir (the thumbs
+    directory of an archive sharing the same media files) are hardlinked instead of
+    being generated again. The archive is compacted first if needed, so only the
+    current version of each message is considered. Returns the number of records
+    updated; call archive_store.compact_if_needed() afterwards to fold the updates
+    into the archive.
+    """
+    global thumbnail_pool
+    archive_dir = Path(archive_dir)
+    media_dir = archive_dir / "media"
+    thumbs_dir = archive_dir / THUMBNAIL_DIR_NAME
+    if Image is None:
+        logger.warning("Image thumbnails require Pillow (pip install Pillow); only video posters are generated.")
+    if shutil.which('ffmpeg') is None:
+        logger.warning("Video posters require ffmpeg on the PATH; videos are left without a poster.")
+    os.makedirs(thumbs_dir, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    if thumbnail_pool is None:
+        thumbnail_pool = ProcessPoolExecutor(max_workers=max(1, THUMBNAIL_WORKERS))
+
+    async def thumbnail_for(record):
+        name = thumbnail_name(record['media_filename'])
+        thumb_path = thumbs_dir / name
+        if not thumb_path.exists():
+            if reuse_dir is not None and (Path(reuse_dir) / name).exists():
+                link_media_object(Path(reuse_dir) / name, thumb_path)
+            elif not await loop.run_in_executor(thumbnail_pool, make_thumbnail, str(media_dir / record['media_filename']), str(thumb_path)):
+                return None
+        return {**record, 'thumbnail_filename': name}
+
+    # Superseded lines must not be scanned: appending an updated copy of one would
+    # bring back a deleted message or media an edit had removed
+    archive_store.compact_if_needed(archive_dir)
+    writer = archive_store.ArchiveWriter(archive_dir, use_sqlite=SQLITE_INDEX)
+    updated = 0
+    batch = []
+
+    async def flush_batch():
+        nonlocal updated
+        results = [r for r in await asyncio.gather(*(thumbnail_for(r) for r in batch)) if r is not None]
+        batch.clear()
+        if results:
+            writer.append(results)
+            updated += len(results)
+
+    try:
+        # Records are streamed, and the pool is fed in batches, so memory stays bounded.
+        # The scan stops at the archive's size when it started, before the updates appended below.
+        scan_size = (archive_dir / archive_store.ARCHIVE_JSONL).stat().st_size
+        for record in archive_store.iter_archive_lines(archive_dir, size=scan_size):
+            media_filename = record.get('media_filename')
+            if not media_filename or media_filename.startswith('skipped_large_file') or record.get('deleted'):
+                continue
+            name = thumbnail_name(media_filename)
+            if name is None or (record.get('thumbnail_filename') == name and (thumbs_dir / name).exists()):
+                continue
+            if not (media_dir / media_filename).exists():
+                continue
+            batch.append(record)
+            if len(batch) >= THUMBNAIL_WORKERS * 8:
+                with metrics_stage('thumbnails'):
+                    await flush_batch()
+        if batch:
+            with metrics_stage('thumbnails'):
+                await flush_batch()
+    finally:
+        writer.close()
+    metrics_add('thumbnails', updated)
+    return updated
+
+def get_archive_dir(group_id, topic_id=None):
+    """Returns the output directory of a group's complete archive or of one of its topics."""
+    if topic_id:
+        return OUTPUT_DIR / f"group_{group_id}" / f"topic_{topic_id}"
+    return OUTPUT_DIR / f"group_{group_id}" / "complete_archive"
+
+def update_catalog(archive_dir, message_count=None):
+    """Refreshes the archive's entry in OUTPUT_DIR/catalog.json, which the viewer lists archives from."""
+    try:
+        archive_store.update_catalog(OUTPUT_DIR, {archive_dir: message_count})
+    except Exception as e:
+        logger.error(f"Error updating the catalog for {archive_dir}: {e}")
+
+def tabular_row(record):
+    """Returns the TABULAR_COLUMNS values of a record, with characters Excel rejects removed."""
+    row = []
+    for column in TABULAR_COLUMNS:
+        value = record.get(column)
+        if isinstance(value, str):
+            value = ILLEGAL_CHARACTERS_RE.sub('', value)
+        row.append(value)
+    return row
+
+def write_excel_streaming(records, excel_path):
+    """Writes records to an .xlsx file in openpyxl write-only mode (constant memory). Returns the row count."""
+    excel_path = Path(excel_path)
+    tmp_path = excel_path.with_name(excel_path.stem + '.tmp.xlsx')
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Messages')
+    sheet.append(TABULAR_COLUMNS)
+    count = 0
+    for record in records:
+        sheet.append(tabular_row(record))
+        count += 1
+    workbook.save(tmp_path)
+    os.replace(tmp_path, excel_path)
+    return count
+
+def write_csv_streaming(records, csv_path):
+    """Writes records to a UTF-8 CSV file (with BOM, so Excel detects the encoding). Returns the row count."""
+    csv_path = Path(csv_path)
+    tmp_path = csv_path.with_name(csv_path.name + '.tmp')
+    count = 0
+    with open(tmp_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(TABULAR_COLUMNS)
+        for record in records:
+            writer.writerow([record.get(column) for column in TABULAR_COLUMNS])
+            count += 1
+    os.replace(tmp_path, csv_path)
+    return count
+
+def export_tabular(archive_dir, export_format):
+    """Writes archive.xlsx and/or archive.csv for an archive, streaming its records. Returns the files written."""
+    archive_dir = Path(archive_dir)
+    written = []
+    writers = []
+    if export_format in ('excel', 'both'):
+        writers.append((write_excel_streaming, archive_dir / 'archive.xlsx'))
+    if export_format in ('csv', 'both'):
+        writers.append((write_csv_streaming, archive_dir / 'archive.csv'))
+    for writer_func, path in writers:
+        try:
+            count = writer_func(archive_store.iter_archive_lines(archive_dir), path)
+            print(f"📊 {path.suffix[1:].upper()} archive saved: {path} ({count} total messages)")
+            written.append(path)
+        except Exception as e:
+            logger.error(f"Error writing {path}: {e}")
+    return written
+
+def record_month(record):
+    """Returns the 'YYYY-MM' Parquet partition of a record ('unknown' without a usable date)."""
+    date_val = record.get('date')
+    if isinstance(date_val, str) and len(date_val) >= 7 and date_val[4] == '-':
+        return date_val[:7]
+    return 'unknown'
+
+def parquet_schema():
+    """Arrow schema of the Parquet dataset, mirroring the archive record fields."""
+    return pa.schema([
+        ('id', pa.int64()),
+        ('date', pa.timestamp('us', tz='UTC')),
+        ('sender_id', pa.int64()),
+        ('sender_username', pa.string()),
+        ('sender_first_name', pa.string()),
+        ('sender_last_name', pa.string()),
+        ('text', pa.string()),
+        ('has_media', pa.bool_()),
+        ('media_filename', pa.string()),
+        ('has_links', pa.bool_()),
+        ('reply_to_message_id', pa.int64()),
+        ('media_type', pa.string()),
+        ('media_id', pa.int64()),
+        ('media_size', pa.int64()),
+        ('media_mime_type', pa.string()),
+        ('media_file_name', pa.string()),
+        ('topic_id', pa.int64()),
+        ('edit_date', pa.timestamp('us', tz='UTC')),
+        ('deleted', pa.bool_())
+    ])
+
+def parquet_dataset_current(dataset_dir):
+    """True if the Parquet dataset exists and was written with the current schema."""
+    dataset_dir = Path(dataset_dir)
+    part_file = next(dataset_dir.glob("month=*/*.parquet"), None) if dataset_dir.exists() else None
+    if part_file is None:
+        return False
+    try:
+        return pq.read_schema(part_file).names == parquet_schema().names
+    except Exception:
+        return False
+
+def parquet_columns(records, schema):
+    """Converts records to column lists for pa.Table.from_pydict()."""
+    columns = {field.name: [] for field in schema}
+    for record in records:
+        for name, values in columns.items():
+            value = record.get(name)
+            if name in ('date', 'edit_date') and value:
+                try:
+                    value = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+                except ValueError:
+                    value = None
+            elif name == 'deleted':
+                value = bool(value) # Only deleted messages carry the field
+            values.append(value)
+    return columns
+
+def export_parquet(archive_dir, months=None):
+    """Writes the archive as a Parquet dataset partitioned by month ('parquet/month=YYYY-MM/').
+
+    Only the partitions listed in months are rewritten (all of them if months is None).
+    Each partition is built in a staging directory and swapped in when complete.
+    Returns the number of partitions written, or None if pyarrow is not installed.
+    """
+    if pq is None:
+        logger.error("Parquet export requires pyarrow (pip install pyarrow).")
+        print("❌ Parquet export requires pyarrow. Install it with: pip install pyarrow")
+        return None
+
+    archive_dir = Path(archive_dir)
+    dataset_dir = archive_dir / PARQUET_DIR_NAME
+    schema = parquet_schema()
+    buffers = {}
+    part_counts = {}
+    buffered_rows = 0
+
+    def staging_dir(month):
+        # Outside dataset_dir, so readers never see a half-written partition
+        return archive_dir / f"{PARQUET_DIR_NAME}.staging" / f"month={month}"
+
+    def flush_buffers():
+        for month, records in buffers.items():
+            if month not in part_counts:
+                shutil.rmtree(staging_dir(month), ignore_errors=True)
+                os.makedirs(staging_dir(month))
+                part_counts[month] = 0
+            table = pa.Table.from_pydict(parquet_columns(records, schema), schema=schema)
+            pq.write_table(table, staging_dir(month) / f"part-{part_counts[month]:05d}.parquet", compression='zstd')
+            part_counts[month] += 1
+        buffers.clear()
+
+    try:
+        for record in archive_store.iter_archive_lines(archive_dir):
+            month = record_month(record)
+            if months is not None and month not in months:
+                continue
+            buffers.setdefault(month, []).append(record)
+            buffered_rows += 1
+            if buffered_rows >= PARQUET_BATCH_ROWS:
+                flush_buffers()
+                buffered_rows = 0
+        flush_buffers()
+
+        os.makedirs(dataset_dir, exist_ok=True)
+        for month in part_counts:
+            final_dir = dataset_dir / f"month={month}"
+            shutil.rmtree(final_dir, ignore_errors=True)
+            os.replace(staging_dir(month), final_dir)
+        shutil.rmtree(archive_dir / f"{PARQUET_DIR_NAME}.staging", ignore_errors=True)
+    except Exception as e:
+        logger.error(f"Error writing Parquet dataset {dataset_dir}: {e}")
+        print(f"❌ Error writing Parquet dataset {dataset_dir}: {e}")
+        return None
+
+    print(f"🧱 Parquet dataset updated: {dataset_dir} ({len(part_counts)} month partition(s) written)")
+    return len(part_counts)
+
+class TopicArchive:
+    """Archive of one forum topic, filled by a --split_topics scrape of its group.
+
+    Records reach it after they were written to the group's complete archive, and
+    their media files are hardlinked from the group's media/ directory, so nothing
+    is downloaded twice. ID ranges covered by the group pass are covered for every
+    topic as well and are mirrored into the topic's checkpoint.
+
+    A forum can have thousands of topics, so at most MAX_OPEN_TOPIC_ARCHIVES keep
+    their writer (archive file and SQLite connection) open. The least recently
+    written one saves its checkpoint and closes, and reopens on its next append.
+    """
+
+    open_archives = OrderedDict() # TopicArchive -> None, least recently written first
+
+    def __init__(self, group_id, topic_id, source_media_dir):
+        self.topic_id = topic_id
+        self.archive_dir = get_archive_dir(group_id, topic_id)
+        self.media_dir = self.archive_dir / "media"
+        self.source_media_dir = source_media_dir
+        os.makedirs(self.media_dir, exist_ok=True)
+        archive_store.migrate_json_archive(self.archive_dir)
+        self.writer = None
+        self._open()
+        if self.writer.sqlite is not None:
+            self.message_ids = archive_store.MessageIdSet(self.writer.sqlite.message_ids())
+        else:
+            self.message_ids = archive_store.MessageIdSet(record['id'] for record in archive_store.iter_archive_lines(self.archive_dir))
+        self.new_messages = 0
+
+    def _open(self):
+        """Opens the writer if needed, closing the least recently written topic archives over the limit."""
+        if self.writer is None:
+            self.writer = archive_store.ArchiveWriter(self.archive_dir, use_sqlite=SQLITE_INDEX)
+            self.writer.checkpoint['in_progress'] = True
+        TopicArchive.open_archives[self] = None
+        TopicArchive.open_archives.move_to_end(self)
+        while len(TopicArchive.open_archives) > max(1, MAX_OPEN_TOPIC_ARCHIVES):
+            least_recent = next(iter(TopicArchive.open_archives))
+            least_recent._close_writer()
+        return self.writer
+
+    def _close_writer(self):
+        """Saves the checkpoint (with coverage not written yet) and closes the writer."""
+        TopicArchive.open_archives.pop(self, None)
+        if self.writer is not None:
+            archive_store.save_checkpoint(self.archive_dir, self.writer.checkpoint)
+            self.writer.close()
+            self.writer = None
+
+    def append(self, records, covered_ranges=()):
+        """Appends the records not archived yet and marks covered_ranges as scraped."""
+        records = [r for r in records if r['id'] not in self.message_ids]
+        for record in records:
+            media_filename = record.get('media_filename')
+            if media_filename and not media_filename.startswith('skipped_large_file'):
+                source_path = self.source_media_dir / media_filename
+                if source_path.exists():
+                    link_media_object(source_path, self.media_dir / media_filename)
+        writer = self._open()
+        checkpoint = writer.checkpoint
+        for low, high in covered_ranges:
+            archive_store.add_covered_range(checkpoint, low, high)
+        if not records:
+            return 0 # The ranges are saved with the next records, or by close()
+        if PARQUET_EXPORT:
+            pending_months = set(checkpoint.get('parquet_pending_months', []))
+            pending_months.update(record_month(r) for r in records)
+            checkpoint['parquet_pending_months'] = sorted(pending_months)
+        writer.append(records)
+        self.message_ids.update(r['id'] for r in records)
+        self.new_messages += len(records)
+        return len(records)
+
+    def close(self, finished):
+        self._open().checkpoint['in_progress'] = not finished
+        self._close_writer()
+
+def finish_archive(archive_dir, new_messages, metrics):
+    """Compacts an archive after a run if needed and rewrites its exports. Returns (message count, tabular files written)."""
+    jsonl_path = archive_dir / archive_store.ARCHIVE_JSONL
+    # Rewrite the JSONL log sorted by ID with one line per message, unless the run only
+    # appended new messages in ID order (the file is then sorted and keeps its inode)
+    total_messages = 0
+    try:
+        if archive_store.needs_compaction(archive_dir):
+            with metrics.stage('compact'):
+                total_messages = archive_store.compact_archive(archive_dir)
+        else:
+            total_messages = archive_store.load_checkpoint(archive_dir).get('messages_written', 0)
+        print(f"💾 JSONL archive saved: {jsonl_path} ({total_messages} total messages)")
+        update_catalog(archive_dir, total_messages)
+    except Exception as e:
+        logger.error(f"Error compacting {jsonl_path}: {e}")
+
+    # Rewrite the Parquet partitions of the months that received messages
+    if PARQUET_EXPORT and total_messages:
+        checkpoint = archive_store.load_checkpoint(archive_dir)
+        full_build = pq is None or not parquet_dataset_current(archive_dir / PARQUET_DIR_NAME)
+        pending_months = None if full_build else set(checkpoint.get('parquet_pending_months', []))
+        if full_build or pending_months:
+            with metrics.stage('export_parquet'):
+                parquet_written = export_parquet(archive_dir, pending_months) is not None
+            if parquet_written:
+                checkpoint['parquet_pending_months'] = []
+                archive_store.save_checkpoint(archive_dir, checkpoint)
+
+    # Write/overwrite the tabular exports, streamed from the compacted archive
+    tabular_files = []
+    if total_messages:
+        messages_since_export = archive_store.load_checkpoint(archive_dir).get('messages_since_export', 0) + new_messages
+        if TABULAR_EXPORT == 'none':
+            print("ℹ️ Tabular export disabled (--export none).")
+        elif (archive_dir / ('archive.csv' if TABULAR_EXPORT == 'csv' else 'archive.xlsx')).exists() \
+                and messages_since_export < EXPORT_MIN_NEW_MESSAGES:
+            print(f"ℹ️ Tabular export deferred: {messages_since_export} new messages since the last export "
+                  f"(threshold {EXPORT_MIN_NEW_MESSAGES}). Run with --export_only to write it now.")
+        else:
+            with metrics.stage('export_tabular'):
+                tabular_files = export_tabular(archive_dir, TABULAR_EXPORT)
+            messages_since_export = 0
+        checkpoint = archive_store.load_checkpoint(archive_dir)
+        checkpoint['messages_since_export'] = messages_since_export
+        archive_store.save_checkpoint(archive_dir, checkpoint)
+    else:
+        print("ℹ️ No messages to save to Excel.")
+    return total_messages, tabular_files
+
 async def run_scraper(target_group_id, target_topic_id=None):
+    """Scrapes one group or topic into its archive. Returns run statistics, or None on failure."""
     global client # Use the globally initialized client
+    target_label = f"{target_group_id}/{target_topic_id}" if target_topic_id else f"{target_group_id}"
+    metrics = RunMetrics(target_label)
+    current_metrics.set(metrics) # Each target runs in its own task, so this does not leak between targets
+    ACTIVE_METRICS[target_label] = metrics
     print("🚀 Telegram Scraper")
     print("=" * 50)
     
-    print("📡 Connecting to Telegram...")
     if not client: # Should have been initialized in __main__
         logger.error("Telegram client not initialized!")
         return
-        
-    await client.connect()
-
-    if not await client.is_user_authorized():
-        print("🔐 Authorization required")
-        await client.send_code_request(PHONE)
-        code = input('📱 Enter SMS code: ')
-        try:
-            await client.sign_in(PHONE, code)
-            print("✅ Successfully logged in")
-        except SessionPasswordNeededError:
-            password = input('🔑 Enter 2FA password: ')
-            await client.sign_in(password=password)
-            print("✅ Successfully logged in with 2FA")
+    if not client.is_connected():
+        await connect_and_authorize()
 
     print(f"📋 Fetching group/channel info for ID: {target_group_id}...")
     try:
-        entity = await client.get_entity(target_group_id)
+        entity = await call_telegram('users', client.get_entity, target_group_id)
     except ValueError as e:
         logger.error(f"Could not find the group/channel with ID {target_group_id}. Make sure the ID is correct and your account has access. Error: {e}")
         print(f"❌ Error: Could not find group/channel with ID {target_group_id}. Please check the ID and your access rights.")
@@ -336,77 +1456,146 @@ async def run_scraper(target_group_id, target_topic_id=None):
 
     if target_topic_id:
         print(f"💬 Starting download for Topic ID {target_topic_id} in Group ID {target_group_id}")
-        output_base_dir = Path("output") / f"group_{target_group_id}" / f"topic_{target_topic_id}"
     else:
         print(f"💬 Starting download for entire Group/Channel ID {target_group_id}")
-        output_base_dir = Path("output") / f"group_{target_group_id}" / "complete_archive"
+    output_base_dir = get_archive_dir(target_group_id, target_topic_id)
     
     media_dir = output_base_dir / "media"
     os.makedirs(media_dir, exist_ok=True)
     print(f"📁 Output directory: {output_base_dir}")
 
-    total_messages = 0
     start_time = time.time()
-    all_user_ids = set()
     
-    json_path = output_base_dir / 'archive.json'
+    jsonl_path = output_base_dir / archive_store.ARCHIVE_JSONL
     excel_path = output_base_dir / 'archive.xlsx'
-    
-    # Check if archive.json exists and load existing message IDs to avoid reprocessing
-    existing_message_ids = set()
-    if json_path.exists():
+
+    # Archives from older versions (archive.json) are converted to append-only JSONL once
+    try:
+        if archive_store.migrate_json_archive(output_base_dir):
+            print(f"🔁 Migrated archive.json to {jsonl_path.name}")
+    except Exception as e:
+        logger.error(f"Could not migrate legacy archive in {output_base_dir}: {e}")
+        print(f"❌ Error: Could not migrate the existing archive.json in {output_base_dir}: {e}")
+        return
+
+    # New records are appended to archive.jsonl every BATCH_SIZE messages, so an
+    # interrupted run keeps everything flushed so far. A record is only written once
+    # its media download has finished; until then it carries the '_media_pending' key.
+    archive_writer = archive_store.ArchiveWriter(output_base_dir, use_sqlite=SQLITE_INDEX)
+
+    # A legacy archive without covered ranges is walked in full once, skipping the messages
+    # it already has (a bitmap, so memory stays small for huge archives). With covered ranges
+    # only the missing ranges are fetched, and the few messages in them that an interrupted
+    # run had already written are appended again, which marks the archive for compaction.
+    existing_message_ids = archive_store.MessageIdSet()
+    covered_ranges = archive_writer.checkpoint.get('covered_ranges')
+    if not covered_ranges:
         try:
-            with open(json_path, 'r', encoding='utf-8') as jf:
-                # Attempt to load as a list of objects
-                content = jf.read()
-                if content.strip(): # Check if file is not empty
-                    # Handle cases: might be a list or list-like structure, or one object per line (not our case)
-                    # For a list of JSON objects:
-                    if content.strip().startswith('[') and content.strip().endswith(']'):
-                        try:
-                            data = json.loads(content)
-                            for item in data:
-                                if isinstance(item, dict) and 'id' in item:
-                                    existing_message_ids.add(item['id'])
-                            print(f"ℹ️ Found {len(existing_message_ids)} existing messages in {json_path}. Will skip them.")
-                        except json.JSONDecodeError as e:
-                            logger.warning(f"Could not parse existing JSON file {json_path} to resume: {e}. Starting fresh for this file.")
-                            existing_message_ids.clear() # Start fresh if parsing fails
-                    else: # If not a valid JSON array structure, assume problematic and start fresh for safety
-                        logger.warning(f"Existing JSON file {json_path} is not a valid JSON array. Starting fresh for this file.")
-                        existing_message_ids.clear()
+            if archive_writer.sqlite is not None:
+                existing_message_ids.update(archive_writer.sqlite.message_ids())
+            else:
+                for item in archive_store.iter_archive_lines(output_base_dir):
+                    existing_message_ids.add(item['id'])
+            if existing_message_ids:
+                print(f"ℹ️ Found {len(existing_message_ids)} existing messages in {jsonl_path}. Will skip them.")
         except Exception as e:
-            logger.error(f"Error reading existing archive {json_path}: {e}. Starting fresh.")
+            logger.error(f"Error reading existing archive {jsonl_path}: {e}. Starting fresh.")
             existing_message_ids.clear()
 
+    archive_writer.checkpoint['in_progress'] = True
+    new_messages_count = 0
 
-    # We will append to JSON file in batches.
-    # For Excel, it's more complex to append, so we'll collect all new data and write at the end or overwrite.
-    # For simplicity, this version will collect all NEW messages for Excel and write them.
-    # If resuming, it means the Excel file might be an older full version or partial.
-    # A robust resume for Excel would require reading it, merging, and rewriting, which is more complex.
-    # Current approach: JSON is appended (if valid), Excel is overwritten with all messages (old+new) or just new if starting fresh.
-    # To make it simpler: we'll write JSON incrementally (new messages). Excel will be written once at the end with ALL messages (including previously existing if any).
+    # --split_topics: records of a forum group are also appended to the archive of their
+    # topic, so the complete archive and all topic archives are filled in one pass.
+    split_topics = SPLIT_TOPICS and not target_topic_id
+    topic_archives = {} # Topic ID -> TopicArchive, opened when the topic's first record is written
+    # ID ranges covered by this run. A legacy archive without covered ranges skips messages
+    # it already has anywhere, which the topic archives may lack, so they are not mirrored then.
+    run_coverage = {}
+    mirror_coverage = not existing_message_ids
 
-    all_messages_for_session = [] # Store all messages (old+new) for final Excel write & JSON reconstruction
-    if json_path.exists() and existing_message_ids: # Load existing messages if we are resuming
+    def fan_out_topics(records):
+        by_topic = defaultdict(list)
+        for record in records:
+            if record.get('topic_id'):
+                by_topic[record['topic_id']].append(record)
+        for topic_id, topic_records in by_topic.items():
+            try:
+                if topic_id not in topic_archives:
+                    topic_archives[topic_id] = TopicArchive(target_group_id, topic_id, media_dir)
+                with metrics.stage('archive_write'):
+                    written = topic_archives[topic_id].append(topic_records, run_coverage.get('covered_ranges', []))
+                metrics.add('topic_messages_written', written)
+            except Exception as e:
+                logger.error(f"Error appending {len(topic_records)} messages to the archive of topic {topic_id}: {e}")
+
+    # Resume state: checkpoint['covered_ranges'] lists the message ID ranges already
+    # scraped completely, so only the missing ranges are requested from Telegram.
+    # Each fetch pass describes one range being fetched and holds its records until they
+    # are written; with several sessions, passes run concurrently. The open-ended range
+    # above the archived messages is fetched oldest first ('ascending'), so a refresh only
+    # appends in ID order and the archive needs no compaction; bounded ranges are fetched
+    # newest first. A pass's 'reached' is the furthest fetched ID whose record, like every
+    # record fetched before it, has been built, so a flush triggered by another pass never
+    # covers messages that are still waiting in this pass's batch.
+    active_passes = []
+
+    def update_covered_range(fetch_pass):
+        unflushed_records = fetch_pass['unflushed']
+        if fetch_pass['ascending']:
+            low = fetch_pass['min_id'] + 1
+            if unflushed_records:
+                # Everything below the lowest record still waiting for media is written
+                high = min(r['id'] for r in unflushed_records) - 1
+            elif fetch_pass['reached'] is not None:
+                high = fetch_pass['reached']
+            else:
+                return
+        else:
+            high = fetch_pass['high']
+            if unflushed_records:
+                # Everything above the highest record still waiting for media is written
+                low = max(r['id'] for r in unflushed_records) + 1
+            elif fetch_pass['done']:
+                low = fetch_pass['min_id'] + 1
+            elif fetch_pass['reached'] is not None:
+                low = fetch_pass['reached']
+            else:
+                return
+        if low <= high:
+            archive_store.add_covered_range(archive_writer.checkpoint, low, high)
+            if split_topics and mirror_coverage:
+                archive_store.add_covered_range(run_coverage, low, high)
+
+    def flush_ready_records():
+        ready = []
+        for fetch_pass in active_passes:
+            unflushed_records = fetch_pass['unflushed']
+            if fetch_pass['ascending']:
+                # Records wait for the media of older ones so they are appended in ID order
+                waiting = next((i for i, r in enumerate(unflushed_records) if '_media_pending' in r), len(unflushed_records))
+                ready.extend(unflushed_records[:waiting])
+                del unflushed_records[:waiting]
+            else:
+                ready.extend(r for r in unflushed_records if '_media_pending' not in r)
+                unflushed_records[:] = [r for r in unflushed_records if '_media_pending' in r]
+            update_covered_range(fetch_pass) # Saved together with the records by append()
+        metrics.add('messages_written', len(ready))
+        if PARQUET_EXPORT and ready:
+            # Months whose Parquet partition must be rewritten, kept until the export succeeded
+            pending_months = set(archive_writer.checkpoint.get('parquet_pending_months', []))
+            pending_months.update(record_month(r) for r in ready)
+            archive_writer.checkpoint['parquet_pending_months'] = sorted(pending_months)
         try:
-            with open(json_path, 'r', encoding='utf-8') as jf:
-                content = jf.read()
-                if content.strip().startswith('[') and content.strip().endswith(']'):
-                    all_messages_for_session = json.loads(content)
+            with metrics.stage('archive_write'):
+                archive_writer.append(ready)
         except Exception as e:
-            logger.warning(f"Could not reload messages from existing {json_path} for merging: {e}")
-            all_messages_for_session = [] # Start with empty if reload fails
-
+            logger.error(f"Error appending {len(ready)} messages to {jsonl_path}: {e}")
+            return
+        if split_topics:
+            fan_out_topics(ready) # Only after the complete archive holds the records
 
-    # Open JSON in append mode if exists and seems valid, otherwise write mode.
-    # This is tricky with the `[` and `]` array structure.
-    # A better approach for incremental JSON is one JSON object per line (JSONL).
-    # For now, we'll collect in memory and write at the end.
-    
-    newly_processed_messages_data = []
-    processed_in_batch_for_excel = 0
+    load_user_cache()
 
     print("⏳ Processing messages...")
     messages_processed_this_run = 0
@@ -414,110 +1603,161 @@ async def run_scraper(target_group_id, target_topic_id=None):
     # Determine reply_to based on whether target_topic_id is provided
     reply_to_id = target_topic_id if target_topic_id else None
 
-    async for msg in client.iter_messages(entity, limit=None, reply_to=reply_to_id): # limit=None to get all
-        if msg.id in existing_message_ids:
-            # logger.debug(f"Skipping already processed message ID: {msg.id}")
-            continue # Skip this message
+    async def process_pending_messages(pending_msgs, fetch_pass, shard):
+        nonlocal messages_processed_this_run, new_messages_count
+        # Senders not attached to the fetched messages are resolved in one batched lookup
+        user_info_map = await get_users_info(shard['client'], [m.sender_id for m in pending_msgs if m.sender_id])
+        for msg in pending_msgs:
+            try:
+                messages_processed_this_run +=1
+                if messages_processed_this_run % 50 == 0 and messages_processed_this_run > 0:
+                    elapsed_time_batch = time.time() - start_time
+                    rate_batch = messages_processed_this_run / elapsed_time_batch if elapsed_time_batch > 0 else 0
+                    print(f"📊 [{target_label}] Processed: {messages_processed_this_run} new messages this run | Rate: {rate_batch:.1f} msg/s")
+
+                user_data = user_info_map.get(msg.sender_id, {'username': None, 'first_name': 'N/A', 'last_name': None})
 
+                message_data = build_message_data(msg, user_data, None)
+                metrics.add('messages_new')
+                fetch_pass['unflushed'].append(message_data)
+                new_messages_count += 1
+                if msg.media and not DOWNLOAD_MEDIA:
+                    metrics.add('media_deferred')
+                if DOWNLOAD_MEDIA and msg.media:
+                    message_data['_media_pending'] = True
+                    # Blocks only when MEDIA_QUEUE_SIZE downloads are already pending (backpressure)
+                    with metrics.stage('media_queue_wait'):
+                        await shard['media_queue'].put((msg, message_data))
+            except Exception as e:
+                logger.error(f"Error processing message ID {msg.id}: {str(e)}")
+                continue
+        fetch_pass['reached'] = pending_msgs[-1].id
+        flush_ready_records()
+
+    # One shard per Telegram session: its own client, entity (access hashes are per
+    # account), rate limiters and media workers. Without additional sessions there is
+    # a single shard on the main client.
+    shards = [{'name': None, 'client': client, 'entity': entity, 'limiters': RATE_LIMITERS}]
+    for session in extra_sessions:
+        limiters = SESSION_RATE_LIMITERS.setdefault(session['name'], new_rate_limiters())
+        token = current_rate_limiters.set(limiters)
         try:
-            messages_processed_this_run +=1
-            if messages_processed_this_run % 50 == 0 and messages_processed_this_run > 0:
-                elapsed_time_batch = time.time() - start_time
-                rate_batch = messages_processed_this_run / elapsed_time_batch if elapsed_time_batch > 0 else 0
-                print(f"📊 Processed: {messages_processed_this_run} new messages this run | Rate: {rate_batch:.1f} msg/s")
-            
-            # logger.debug(f"Processing message ID: {msg.id}")
-            if msg.sender_id:
-                all_user_ids.add(msg.sender_id)
-                
-            # Fetch user info (can be batched later for optimization if this becomes a bottleneck)
-            # For now, fetch one by one, relying on user_cache
-            user_info_map = await get_users_info(client, [msg.sender_id] if msg.sender_id else [])
-            user_data = user_info_map.get(msg.sender_id, {'username': None, 'first_name': 'N/A', 'last_name': None})
-                
-            media_filename = None
-            if DOWNLOAD_MEDIA and msg.media:
-                for attempt in range(MAX_RETRIES):
-                    media_filename = await download_media_file(client, msg, media_dir)
-                    if media_filename: # Includes "skipped_large_file" string
-                        if "skipped_large_file" in media_filename:
-                            # logger.info(f"Media skipped for msg {msg.id}: {media_filename}")
-                            pass # Already logged in download_media_file
-                        break # Break from retry loop if media processed (downloaded, skipped, or failed definitively by download_media_file)
-                    # logger.debug(f"Retrying media download for msg {msg.id}, attempt {attempt+1}")
-                    await asyncio.sleep(1) # Wait before retrying
-            
-            message_data = {
-                'id': msg.id,
-                'date': msg.date.isoformat() if msg.date else None, # Store in ISO format
-                'sender_id': msg.sender_id,
-                'sender_username': user_data.get('username'),
-                'sender_first_name': user_data.get('first_name'),
-                'sender_last_name': user_data.get('last_name'),
-                'text': msg.text.replace('\\n', ' ') if msg.text else '', # Normalize newlines
-                'has_media': bool(msg.media),
-                'media_filename': media_filename, # Can be None, actual filename, or "skipped..."
-                'has_links': 'http' in msg.text if msg.text else False, # Basic link detection
-                'reply_to_message_id': msg.reply_to_msg_id if msg.reply_to and msg.reply_to.reply_to_msg_id else None
-            }
-            
-            newly_processed_messages_data.append(message_data)
-            total_messages += 1 # Counts all messages (new and potentially existing if we were to merge fully)
-                                # This 'total_messages' might be confusing if we are just appending.
-                                # Let's rename it to 'newly_fetched_messages_count'
-            
-            # Batch saving for Excel (still collects all new messages in memory)
-            # if len(newly_processed_messages_data) % BATCH_SIZE == 0:
-            #     # This was for incremental Excel write, which is complex.
-            #     # We will write Excel once at the end.
-            #     pass
-                
+            # Targets scraped concurrently share the session: one connects (and signs in) at a time
+            async with session.setdefault('lock', asyncio.Lock()):
+                await connect_and_authorize(session['client'], session.get('phone'), session['name'])
+                shard_entity = await resolve_entity(session['client'], target_group_id)
         except Exception as e:
-            logger.error(f"Error processing message ID {msg.id}: {str(e)}")
+            logger.error(f"Session '{session['name']}' cannot access group {target_group_id}: {e}")
+            print(f"⚠️ Session '{session['name']}' cannot access group {target_group_id}, continuing without it.")
             continue
-    
-    # Combine newly processed messages with existing ones for the final list
-    final_message_list = []
-    existing_ids_for_update = {m['id'] for m in all_messages_for_session}
-    
-    for m_exist in all_messages_for_session:
-        final_message_list.append(m_exist)
-        
-    for m_new in newly_processed_messages_data:
-        if m_new['id'] not in existing_ids_for_update: # Add if truly new
-            final_message_list.append(m_new)
-            
-    # Sort all messages by ID (or date) before writing
-    final_message_list.sort(key=lambda x: x['id'])
+        finally:
+            current_rate_limiters.reset(token)
+        shards.append({'name': session['name'], 'client': session['client'], 'entity': shard_entity, 'limiters': limiters})
 
+    # Media is downloaded by a pool of workers per shard while iteration continues;
+    # each worker fills media_filename into the record once its download finishes.
+    for shard in shards:
+        shard['media_queue'] = asyncio.Queue(maxsize=MEDIA_QUEUE_SIZE)
+        shard['media_workers'] = []
+        if DOWNLOAD_MEDIA:
+            token = current_rate_limiters.set(shard['limiters']) # Copied into the worker tasks
+            try:
+                shard['media_workers'] = [asyncio.create_task(media_download_worker(shard['client'], shard['media_queue'], media_dir))
+                                          for _ in range(max(1, MEDIA_DOWNLOAD_WORKERS))]
+            finally:
+                current_rate_limiters.reset(token)
+
+    id_ranges = archive_store.missing_id_ranges(archive_writer.checkpoint)
+    if existing_message_ids:
+        print("ℹ️ No resume information for this archive yet. Walking the full history once.")
+    elif covered_ranges:
+        print(f"ℹ️ Fetching {len(id_ranges)} missing ID range(s) above/between the archived messages "
+              f"(high-water mark: {archive_writer.checkpoint.get('high_water_mark')}).")
+    if len(shards) > 1:
+        id_ranges = await shard_id_ranges(client, entity, id_ranges, len(shards) * SHARD_SLICES_PER_SESSION, reply_to_id)
+        print(f"🧩 Sharding {len(id_ranges)} ID slice(s) across {len(shards)} sessions")
+
+    async def fetch_range(shard, min_id, max_id):
+        ascending = max_id is None
+        fetch_pass = {'min_id': min_id, 'high': None if ascending else max_id - 1, 'ascending': ascending,
+                      'reached': None, 'done': False, 'unflushed': []}
+        active_passes.append(fetch_pass)
+        pending_msgs = []
+        if ascending: # offset_id is the exclusive lower bound when iterating in reverse
+            history = iter_history(shard['client'], shard['entity'], limit=None, reply_to=reply_to_id,
+                                   min_id=min_id, offset_id=min_id, reverse=True)
+        else:
+            history = iter_history(shard['client'], shard['entity'], limit=None, reply_to=reply_to_id, # limit=None to get all
+                                   min_id=min_id, max_id=max_id)
+        async for msg in timed_iteration(history, 'history'):
+            metrics.add('messages_fetched')
+            if msg.id in existing_message_ids:
+                if not pending_msgs:
+                    fetch_pass['reached'] = msg.id # Already archived, and nothing before it is pending
+                continue # Skip this message
+
+            if msg.sender_id:
+                remember_sender(msg)
+            pending_msgs.append(msg)
+            if len(pending_msgs) >= BATCH_SIZE:
+                await process_pending_messages(pending_msgs, fetch_pass, shard)
+                pending_msgs = []
 
-    # Write/overwrite the JSON file with all (old + new) messages
+        if pending_msgs:
+            await process_pending_messages(pending_msgs, fetch_pass, shard)
+        # The range counts as covered only once all of its media is written
+        with metrics.stage('media_drain'):
+            await shard['media_queue'].join()
+        fetch_pass['done'] = True
+        flush_ready_records()
+        active_passes.remove(fetch_pass)
+        archive_store.save_checkpoint(output_base_dir, archive_writer.checkpoint)
+
+    async def shard_worker(shard):
+        current_rate_limiters.set(shard['limiters']) # This task talks to the shard's session only
+        while id_ranges: # Ranges are taken newest first; idle shards pick up the next one
+            min_id, max_id = id_ranges.pop(0)
+            await fetch_range(shard, min_id, max_id)
+
+    shard_tasks = [asyncio.create_task(shard_worker(shard)) for shard in shards]
     try:
-        with open(json_path, 'w', encoding='utf-8') as json_file_final:
-            json.dump(final_message_list, json_file_final, ensure_ascii=False, indent=2)
-        print(f"💾 JSON archive saved: {json_path} ({len(final_message_list)} total messages)")
-    except Exception as e:
-        logger.error(f"Error writing final JSON to {json_path}: {e}")
+        await asyncio.gather(*shard_tasks)
+        for shard in shards:
+            for _ in shard['media_workers']:
+                await shard['media_queue'].put(None)
+            await asyncio.gather(*shard['media_workers'])
+        archive_writer.checkpoint['in_progress'] = False
+        archive_store.save_checkpoint(output_base_dir, archive_writer.checkpoint)
+    finally:
+        # On errors or Ctrl-C keep everything that is complete; records still
+        # waiting for media are fetched again on the next run.
+        pending_tasks = shard_tasks + [worker for shard in shards for worker in shard['media_workers']]
+        for task in pending_tasks:
+            task.cancel()
+        await asyncio.gather(*pending_tasks, return_exceptions=True)
+        flush_ready_records() # Messages fetched but not yet processed stay uncovered (see 'reached')
+        archive_writer.close()
+        for topic_archive in topic_archives.values():
+            try:
+                topic_archive.append([], run_coverage.get('covered_ranges', []))
+                topic_archive.close(finished=not archive_writer.checkpoint['in_progress'])
+            except Exception as e:
+                logger.error(f"Error closing the archive of topic {topic_archive.topic_id}: {e}")
+        save_user_cache()
 
-    # Write/overwrite the Excel file
-    if final_message_list:
+    # Thumbnails and video posters, folded into the archive by the compaction below
+    if THUMBNAILS:
         try:
-            df = pd.DataFrame(final_message_list)
-            # Reorder columns for better readability in Excel
-            excel_columns = ['id', 'date', 'sender_id', 'sender_username', 'sender_first_name', 'sender_last_name', 
-                             'text', 'has_media', 'media_filename', 'has_links', 'reply_to_message_id']
-            # Filter df columns to only those that exist in the DataFrame to prevent KeyErrors
-            df_excel = df[[col for col in excel_columns if col in df.columns]]
-            
-            with pd.ExcelWriter(excel_path, engine='openpyxl') as writer_final:
-                 df_excel.to_excel(writer_final, index=False, sheet_name='Messages')
-            print(f"📊 Excel archive saved: {excel_path} ({len(final_message_list)} total messages)")
-            del df # Free memory
-            del df_excel
+            print(f"🖼️ Thumbnails: {await generate_thumbnails(output_base_dir)} created")
+            for topic_archive in topic_archives.values():
+                await generate_thumbnails(topic_archive.archive_dir, reuse_dir=output_base_dir / THUMBNAIL_DIR_NAME)
         except Exception as e:
-            logger.error(f"Error writing Excel file to {excel_path}: {e}")
-    else:
-        print("ℹ️ No messages to save to Excel.")
+            logger.error(f"Error generating thumbnails for {output_base_dir}: {e}")
+
+    total_messages, tabular_files = finish_archive(output_base_dir, new_messages_count, metrics)
+    for topic_archive in topic_archives.values():
+        print(f"🧵 Topic {topic_archive.topic_id}: {topic_archive.new_messages} new message(s)")
+        finish_archive(topic_archive.archive_dir, topic_archive.new_messages, metrics)
 
     
     elapsed_time = time.time() - start_time
@@ -526,14 +1766,37 @@ async def run_scraper(target_group_id, target_topic_id=None):
     print("🎉 SCRAPING COMPLETED SUCCESSFULLY!")
     print("=" * 50)
     print(f"📊 Statistics for this run:")
-    print(f"   • New messages fetched: {len(newly_processed_messages_data)}")
-    print(f"   • Total messages in archive: {len(final_message_list)}")
+    print(f"   • New messages fetched: {new_messages_count}")
+    print(f"   • Total messages in archive: {total_messages}")
     print(f"   • Execution time: {elapsed_time:.1f}s")
-    if elapsed_time > 0 and len(newly_processed_messages_data) > 0:
-        print(f"   • Average rate (new messages): {len(newly_processed_messages_data)/elapsed_time:.1f} messages/s")
+    if elapsed_time > 0 and new_messages_count > 0:
+        print(f"   • Average rate (new messages): {new_messages_count/elapsed_time:.1f} messages/s")
+    if metrics.counters.get('media_deferred'):
+        print(f"   • Media not downloaded (metadata only): {metrics.counters['media_deferred']} - fetch it with --backfill_media")
+    throttling = throttle_summary()
+    print(f"   • Time throttled (rate limits + FloodWait, all classes): {throttling['total_seconds']:.1f}s")
+    for name, class_stats in throttling['classes'].items():
+        print(f"     - {name}: {class_stats['requests']} requests, {class_stats['flood_waits']} FloodWaits, "
+              f"{class_stats['throttled_seconds']:.1f}s throttled, {class_stats['flood_wait_seconds']:.1f}s in FloodWait, "
+              f"now {class_stats['rate']:.2f} req/s")
+    logger.info(f"Rate limiter statistics: {throttling}")
+    if metrics.stages:
+        print("   • Time per stage: " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in sorted(metrics.stages.items())))
+    if metrics.counters.get('bytes_downloaded'):
+        print(f"   • Downloaded: {metrics.counters['bytes_downloaded']/1024/1024:.1f}MB")
+
+    # Machine-readable statistics of this run, next to the archive
+    run_stats = metrics.to_dict()
+    run_stats.update({'new_messages': new_messages_count, 'total_messages': total_messages})
+    try:
+        archive_store.write_json_atomic(output_base_dir / RUN_STATS_FILE, run_stats)
+    except Exception as e:
+        logger.error(f"Error writing run statistics to {output_base_dir / RUN_STATS_FILE}: {e}")
     print(f"\n📁 Output files in: {output_base_dir}")
-    print(f"   • 📄 JSON: {json_path.name}")
-    print(f"   • 📊 Excel: {excel_path.name}")
+    print(f"   • 📄 JSONL: {jsonl_path.name}")
+    for tabular_file in tabular_files:
+        print(f"   • 📊 {tabular_file.suffix[1:].upper()}: {tabular_file.name}")
+    print(f"   • 📈 Run statistics: {RUN_STATS_FILE}")
     if DOWNLOAD_MEDIA:
         try:
             media_count = len([f for f in os.listdir(media_dir) if os.path.isfile(os.path.join(media_dir, f))])
@@ -543,6 +1806,493 @@ async def run_scraper(target_group_id, target_topic_id=None):
             
     print(f"\n📝 Detailed logs: telegram_scraper.log")
     print("=" * 50)
+    return {
+        'target': target_label,
+        'new_messages': new_messages_count,
+        'total_messages': total_messages,
+        'elapsed': elapsed_time,
+        'throttled_seconds': throttling['total_seconds']
+    }
+
+def media_category(record):
+    """Download priority class of a record's media for --media_order images_first: images, other files, videos."""
+    mime_type = record.get('media_mime_type') or ''
+    if record.get('media_type') == 'photo' or mime_type.startswith('image/'):
+        return 0
+    if mime_type.startswith('video/'):
+        return 2
+    return 1
+
+def select_media_backfill(records, order='smallest', budget_bytes=None):
+    """Orders records with pending media by the backfill policy and applies the byte budget.
+
+    order is 'smallest', 'newest' or 'images_first' (images, then other files, then
+    videos, each smallest first). Records of unknown size sort last and are left out
+    when a budget is set.
+    """
+    unknown_size = float('inf')
+    if order == 'newest':
+        key = lambda r: -r['id']
+    elif order == 'images_first':
+        key = lambda r: (media_category(r), r.get('media_size') or unknown_size, -r['id'])
+    else:
+        key = lambda r: (r.get('media_size') or unknown_size, -r['id'])
+    ordered = sorted(records, key=key)
+    if budget_bytes is None:
+        return ordered
+    selected = []
+    total = 0
+    for record in ordered:
+        size = record.get('media_size')
+        if size and total + size <= budget_bytes: # Smaller files later in the order may still fit
+            selected.append(record)
+            total += size
+    return selected
+
+async def backfill_media(target_group_id, target_topic_id=None, order='smallest', budget_bytes=None):
+    """Downloads the media of archived messages that have none yet, in priority order.
+
+    The second phase of a --metadata_only scrape: the messages are re-read by ID in
+    batches, their media is downloaded by the usual worker pool, and the updated
+    records are appended to the archive (superseding the old lines) before it is
+    compacted. Only the records still missing their media are read into memory.
+    Returns statistics, or None on failure.
+    """
+    target_label = f"{target_group_id}/{target_topic_id}" if target_topic_id else f"{target_group_id}"
+    metrics = RunMetrics(f"{target_label} (media backfill)")
+    current_metrics.set(metrics)
+    ACTIVE_METRICS[metrics.target] = metrics
+    archive_dir = get_archive_dir(target_group_id, target_topic_id)
+    if not archive_store.archive_exists(archive_dir):
+        print(f"❌ No archive found in {archive_dir}")
+        return None
+    await connect_and_authorize()
+    try:
+        entity = await call_telegram('users', client.get_entity, target_group_id)
+    except Exception as e:
+        logger.error(f"Could not fetch entity for group ID {target_group_id}: {e}")
+        print(f"❌ Error: Could not find group/channel with ID {target_group_id}.")
+        return None
+
+    # Compacted first if needed, so the stream holds only current records and just the
+    # candidates are kept in memory
+    with metrics.stage('compact'):
+        archive_store.compact_if_needed(archive_dir)
+    with metrics.stage('archive_read'):
+        pending = [r for r in archive_store.iter_archive_lines(archive_dir)
+                   if r.get('has_media') and not r.get('media_filename') and not r.get('deleted')]
+    selected = select_media_backfill(pending, order, budget_bytes)
+    if not selected:
+        print(f"ℹ️ [{target_label}] No pending media to download ({len(pending)} pending, none selected).")
+        return {'target': target_label, 'selected': 0, 'downloaded': 0}
+    selected_bytes = sum(r.get('media_size') or 0 for r in selected)
+    print(f"🖼️ [{target_label}] Backfilling media of {len(selected)} of {len(pending)} pending message(s) "
+          f"({selected_bytes/1024/1024:.1f}MB known size, order: {order})")
+
+    media_dir = archive_dir / "media"
+    os.makedirs(media_dir, exist_ok=True)
+    writer = archive_store.ArchiveWriter(archive_dir, use_sqlite=SQLITE_INDEX)
+    in_flight = [] # Copies of the selected records, written once their download finished
+    downloaded = 0
+    start_time = time.time()
+
+    def flush_downloaded():
+        nonlocal downloaded
+        ready = [r for r in in_flight if '_media_pending' not in r]
+        in_flight[:] = [r for r in in_flight if '_media_pending' in r]
+        ready = [r for r in ready if r.get('media_filename')] # Failed downloads stay pending
+        if not ready:
+            return
+        checkpoint = writer.checkpoint
+        checkpoint['messages_since_export'] = checkpoint.get('messages_since_export', 0) + len(ready)
+        if PARQUET_EXPORT:
+            pending_months = set(checkpoint.get('parquet_pending_months', []))
+            pending_months.update(record_month(r) for r in ready)
+            checkpoint['parquet_pending_months'] = sorted(pending_months)
+        try:
+            with metrics.stage('archive_write'):
+                writer.append(ready)
+            downloaded += len(ready)
+        except Exception as e:
+            logger.error(f"Error appending {len(ready)} updated records to {writer.path}: {e}")
+
+    media_queue = asyncio.Queue(maxsize=MEDIA_QUEUE_SIZE)
+    media_workers = [asyncio.create_task(media_download_worker(client, media_queue, media_dir))
+                     for _ in range(max(1, MEDIA_DOWNLOAD_WORKERS))]
+    try:
+        for i in range(0, len(selected), BATCH_SIZE):
+            batch = selected[i:i + BATCH_SIZE]
+            with metrics.stage('history'):
+                messages = await call_telegram('history', client.get_messages, entity, ids=[r['id'] for r in batch])
+            for record, msg in zip(batch, messages):
+                if msg is None or not msg.media: # Deleted since, or the media was removed
+                    metrics.add('media_unavailable')
+                    continue
+                record = dict(record)
+                record.update(media_descriptor(msg.media))
+                record['_media_pending'] = True
+                in_flight.append(record)
+                with metrics.stage('media_queue_wait'):
+                    await media_queue.put((msg, record))
+            flush_downloaded()
+            print(f"📊 [{target_label}] Media backfill: {min(i + BATCH_SIZE, len(selected))}/{len(selected)} queued, {downloaded} saved")
+        with metrics.stage('media_drain'):
+            await media_queue.join()
+        for _ in media_workers:
+            await media_queue.put(None)
+        await asyncio.gather(*media_workers)
+    finally:
+        for worker in media_workers:
+            worker.cancel()
+        await asyncio.gather(*media_workers, return_exceptions=True) # Let cancelled workers finish before the writer closes
+        flush_downloaded()
+        writer.close()
+
+    if archive_store.needs_compaction(archive_dir):
+        with metrics.stage('compact'):
+            archive_store.compact_archive(archive_dir)
+    update_catalog(archive_dir, archive_store.load_checkpoint(archive_dir).get('messages_written'))
+    elapsed_time = time.time() - start_time
+    print(f"✅ [{target_label}] Media backfill finished: {downloaded} of {len(selected)} file(s) saved in {elapsed_time:.1f}s"
+          + (f", {metrics.counters['media_unavailable']} no longer available" if metrics.counters.get('media_unavailable') else ""))
+    return {'target': target_label, 'selected': len(selected), 'downloaded': downloaded, 'elapsed': elapsed_time}
+
+def select_sync_records(records, window, sample_blocks, rng=None):
+    """Returns the archived records --sync_edits re-checks, sorted by ID.
+
+    These are the newest `window` records (where edits and deletions are most likely)
+    plus `sample_blocks` random runs of SYNC_SAMPLE_BLOCK consecutive older records, so
+    the rest of the archive is spot-checked a few requests at a time.
+
+    records must be the current records in ID order, and may be a stream: only the
+    newest window and the sampled blocks (a reservoir sample) are kept in memory.
+    """
+    rng = rng or random.Random()
+    window = max(0, window)
+    newest = deque()
+    samples = [] # Sampled blocks of older records
+    block = []
+    block_count = 0
+
+    def end_block():
+        nonlocal block, block_count
+        if block_count < sample_blocks:
+            samples.append(block)
+        else:
+            slot = rng.randrange(block_count + 1)
+            if slot < sample_blocks:
+                samples[slot] = block
+        block_count += 1
+        block = []
+
+    for record in records:
+        if record.get('deleted'):
+            continue
+        newest.append(record)
+        if len(newest) > window:
+            block.append(newest.popleft()) # Older than the window
+            if len(block) == SYNC_SAMPLE_BLOCK:
+                end_block()
+    if block:
+        end_block()
+    selected = list(newest)
+    for sampled in samples:
+        selected.extend(sampled)
+    return sorted(selected, key=lambda r: r['id'])
+
+def synced_record(record, msg):
+    """Returns the updated version of an archived record, or None if the message did not change."""
+    if msg is None:
+        return {**record, 'deleted': True}
+    edit_date = msg.edit_date.isoformat() if getattr(msg, 'edit_date', None) else None
+    text = msg.text.replace('\\n', ' ') if msg.text else ''
+    if edit_date == record.get('edit_date') and text == record.get('text'):
+        return None
+    user_data = {'username': record.get('sender_username'), 'first_name': record.get('sender_first_name'),
+                 'last_name': record.get('sender_last_name')}
+    updated = {**record, **build_message_data(msg, user_data, record.get('media_filename'))}
+    if updated.get('media_id') != record.get('media_id'):
+        updated['media_filename'] = None # The media was replaced; --backfill_media fetches the new file
+    return updated
+
+async def sync_edits(target_group_id, target_topic_id=None, window=None, sample_blocks=0):
+    """Re-checks archived messages for edits and deletions without re-scraping the archive.
+
+    The archive is compacted first if needed and streamed through select_sync_records().
+    The selected messages are re-read by ID in batches; changed records are appended in
+    their new version and deleted ones are appended with 'deleted': True, then the
+    archive is compacted and its exports rewritten. Returns statistics, or None on failure.
+    """
+    window = SYNC_WINDOW_MESSAGES if window is None else window
+    target_label = f"{target_group_id}/{target_topic_id}" if target_topic_id else f"{target_group_id}"
+    metrics = RunMetrics(f"{target_label} (edit sync)")
+    current_metrics.set(metrics)
+    ACTIVE_METRICS[metrics.target] = metrics
+    archive_dir = get_archive_dir(target_group_id, target_topic_id)
+    if not archive_store.archive_exists(archive_dir):
+        print(f"❌ No archive found in {archive_dir}")
+        return None
+    await connect_and_authorize()
+    try:
+        entity = await call_telegram('users', client.get_entity, target_group_id)
+    except Exception as e:
+        logger.error(f"Could not fetch entity for group ID {target_group_id}: {e}")
+        print(f"❌ Error: Could not find group/channel with ID {target_group_id}.")
+        return None
+
+    with metrics.stage('compact'):
+        archive_store.compact_if_needed(archive_dir) # So each message is read once, in ID order
+    with metrics.stage('archive_read'):
+        selected = select_sync_records(archive_store.iter_archive_lines(archive_dir), window, sample_blocks)
+    print(f"🔄 [{target_label}] Checking {len(selected)} archived message(s) for edits and deletions "
+          f"(newest {window}, {sample_blocks} sampled block(s) of {SYNC_SAMPLE_BLOCK})")
+
+    writer = archive_store.ArchiveWriter(archive_dir, use_sqlite=SQLITE_INDEX)
+    edited = deleted = 0
+    start_time = time.time()
+    try:
+        for i in range(0, len(selected), BATCH_SIZE):
+            batch = selected[i:i + BATCH_SIZE]
+            with metrics.stage('history'):
+                messages = await call_telegram('history', client.get_messages, entity, ids=[r['id'] for r in batch])
+            updated = []
+            for record, msg in zip(batch, messages):
+                new_record = synced_record(record, msg)
+                if new_record is not None:
+                    updated.append(new_record)
+            if not updated:
+                continue
+            checkpoint = writer.checkpoint
+            checkpoint['messages_since_export'] = checkpoint.get('messages_since_export', 0) + len(updated)
+            if PARQUET_EXPORT:
+                pending_months = set(checkpoint.get('parquet_pending_months', []))
+                pending_months.update(record_month(r) for r in updated)
+                checkpoint['parquet_pending_months'] = sorted(pending_months)
+            with metrics.stage('archive_write'):
+                writer.append(updated)
+            batch_deleted = sum(1 for r in updated if r.get('deleted'))
+            deleted += batch_deleted
+            edited += len(updated) - batch_deleted
+            metrics.add('messages_deleted', batch_deleted)
+            metrics.add('messages_edited', len(updated) - batch_deleted)
+    finally:
+        writer.close()
+
+    finish_archive(archive_dir, 0, metrics) # Updates were already counted in messages_since_export
+    elapsed_time = time.time() - start_time
+    print(f"✅ [{target_label}] Edit sync finished in {elapsed_time:.1f}s: {edited} edited, {deleted} deleted "
+          f"of {len(selected)} checked")
+    return {'target': target_label, 'checked': len(selected), 'edited': edited, 'deleted': deleted, 'elapsed': elapsed_time}
+
+def parse_target(target_str):
+    """Parses a command line target of the form GROUP_ID or GROUP_ID:TOPIC_ID."""
+    group_part, _, topic_part = str(target_str).partition(':')
+    try:
+        return int(group_part), int(topic_part) if topic_part else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid target '{target_str}'. Expected GROUP_ID or GROUP_ID:TOPIC_ID.")
+
+async def run_targets(targets, max_concurrent=None):
+    """Scrapes several groups/topics concurrently over the one connected client."""
+    max_concurrent = max_concurrent or MAX_CONCURRENT_TARGETS
+    await connect_and_authorize() # Connection, authorization and entity cache are shared by all targets
+    semaphore = asyncio.Semaphore(max(1, max_concurrent))
+    print(f"🎯 Scraping {len(targets)} target(s), up to {max_concurrent} at a time")
+
+    async def run_one(group_id, topic_id):
+        async with semaphore:
+            try:
+                return await run_scraper(group_id, topic_id)
+            except Exception as e:
+                logger.error(f"Scrape of target {group_id}/{topic_id} failed: {e}", exc_info=True)
+                return None
+
+    results = await asyncio.gather(*(run_one(group_id, topic_id) for group_id, topic_id in targets))
+
+    print("\n" + "=" * 50)
+    print(f"🏁 All targets finished")
+    print("=" * 50)
+    for (group_id, topic_id), result in zip(targets, results):
+        label = f"{group_id}/{topic_id}" if topic_id else f"{group_id}"
+        if result is None:
+            print(f"   • ❌ {label}: failed (see telegram_scraper.log)")
+        else:
+            print(f"   • ✅ {label}: {result['new_messages']} new, {result['total_messages']} total, {result['elapsed']:.1f}s")
+    return results
+
+class FollowedArchive:
+    """Live state of one archive in --follow mode.
+
+    Changes received as events are buffered and appended by flush(), so each
+    archive is fsynced at most once per FOLLOW_FLUSH_INTERVAL. Edits append the
+    new version of a record and deletions append it with 'deleted': True; the
+    last line per message ID wins when the archive is read or compacted.
+
+    The archive is compacted when following starts, so a deleted message is looked
+    up in the memorized offsets of the lines appended since, or by binary search in
+    the sorted part of the file before them.
+    """
+
+    def __init__(self, group_id, topic_id=None):
+        self.group_id = group_id
+        self.topic_id = topic_id
+        self.label = f"{group_id}/{topic_id}" if topic_id else f"{group_id}"
+        self.archive_dir = get_archive_dir(group_id, topic_id)
+        self.media_dir = self.archive_dir / "media"
+        os.makedirs(self.media_dir, exist_ok=True)
+        self.metrics = RunMetrics(f"{self.label} (follow)")
+        ACTIVE_METRICS[self.metrics.target] = self.metrics
+        archive_store.compact_if_needed(self.archive_dir)
+        self.writer = archive_store.ArchiveWriter(self.archive_dir, use_sqlite=SQLITE_INDEX)
+        self.sorted_size = self.writer.size # archive.jsonl is sorted by ID up to here
+        self.offsets = {} # Message ID -> offset of its latest line appended while following
+        if self.writer.sqlite is not None:
+            self.message_ids = archive_store.MessageIdSet(self.writer.sqlite.message_ids())
+        else:
+            self.message_ids = archive_store.MessageIdSet(record['id'] for record in archive_store.iter_archive_lines(self.archive_dir))
+        self.pending = [] # Records waiting for the next flush (or for their media)
+        self.deleted_ids = set()
+        self.media_queue = asyncio.Queue()
+        self.media_workers = []
+
+    def start(self):
+        if not DOWNLOAD_MEDIA:
+            return
+        token = current_metrics.set(self.metrics) # Copied into the worker tasks
+        try:
+            self.media_workers = [asyncio.create_task(media_download_worker(client, self.media_queue, self.media_dir))
+                                  for _ in range(max(1, MEDIA_DOWNLOAD_WORKERS))]
+        finally:
+            current_metrics.reset(token)
+
+    def matches(self, chat_id, msg):
+        """True if a message of chat_id belongs in this archive."""
+        if chat_id != self.group_id:
+            return False
+        return self.topic_id is None or self.topic_id in (msg.id, message_topic_id(msg))
+
+    async def add_message(self, msg, edited=False):
+        if msg.sender_id:
+            remember_sender(msg)
+        user_info_map = await get_users_info(client, [msg.sender_id] if msg.sender_id else [])
+        user_data = user_info_map.get(msg.sender_id, {'username': None, 'first_name': 'N/A', 'last_name': None})
+        message_data = build_message_data(msg, user_data, None)
+        self.metrics.add('messages_edited' if edited and msg.id in self.message_ids else 'messages_new')
+        self.message_ids.add(msg.id)
+        self.pending.append(message_data)
+        if DOWNLOAD_MEDIA and msg.media:
+            message_data['_media_pending'] = True
+            await self.media_queue.put((msg, message_data))
+
+    def mark_deleted(self, message_ids):
+        deleted = self.message_ids.intersection(message_ids)
+        self.deleted_ids.update(deleted)
+        return len(deleted)
+
+    def flush(self):
+        """Appends every record that is ready (and the pending deletions) in one batch."""
+        ready = [r for r in self.pending if '_media_pending' not in r]
+        self.pending = [r for r in self.pending if '_media_pending' in r]
+        if self.deleted_ids:
+            deleted, self.deleted_ids = self.deleted_ids, set()
+            buffered_ids = {r['id'] for r in ready + self.pending}
+            for record in ready + self.pending: # Records still waiting for media carry the flag when written
+                if record['id'] in deleted:
+                    record['deleted'] = True
+            with self.metrics.stage('archive_read'):
+                archived = [archive_store.read_record_at(self.archive_dir, self.offsets[msg_id])
+                            for msg_id in deleted - buffered_ids if msg_id in self.offsets]
+                archived.extend(archive_store.find_sorted_records(
+                    self.archive_dir, deleted - buffered_ids - self.offsets.keys(), self.sorted_size).values())
+            for record in archived:
+                if not record.get('deleted'):
+                    record['deleted'] = True
+                    ready.append(record)
+            self.metrics.add('messages_deleted', len(deleted))
+        if not ready:
+            return 0
+        checkpoint = self.writer.checkpoint
+        checkpoint['messages_since_export'] = checkpoint.get('messages_since_export', 0) + len(ready)
+        if PARQUET_EXPORT:
+            pending_months = set(checkpoint.get('parquet_pending_months', []))
+            pending_months.update(record_month(r) for r in ready)
+            checkpoint['parquet_pending_months'] = sorted(pending_months)
+        try:
+            with self.metrics.stage('archive_write'):
+                offsets = self.writer.append(ready)
+            self.offsets.update((record['id'], offset) for record, offset in zip(ready, offsets))
+            self.metrics.add('messages_written', len(ready))
+        except Exception as e:
+            logger.error(f"Error appending {len(ready)} live updates to {self.writer.path}: {e}")
+            return 0
+        return len(ready)
+
+    async def close(self):
+        # Records still waiting for media are dropped: follow mode does not extend the
+        # covered ID ranges, so the next regular run fetches those messages again.
+        for worker in self.media_workers:
+            worker.cancel()
+        await asyncio.gather(*self.media_workers, return_exceptions=True)
+        self.flush()
+        self.writer.close()
+        try:
+            update_catalog(self.archive_dir, archive_store.compact_if_needed(self.archive_dir))
+        except Exception as e:
+            logger.error(f"Error compacting {self.archive_dir}: {e}")
+
+async def follow_targets(targets):
+    """Keeps the archives of targets up to date from new-message, edit and delete events until cancelled.
+
+    Events can be missed while disconnected, so the regular (backfill) run is still
+    the source of truth for complete ID ranges; follow mode only adds freshness.
+    """
+    await connect_and_authorize()
+    load_user_cache()
+    archives = [FollowedArchive(group_id, topic_id) for group_id, topic_id in targets]
+    for archive in archives:
+        archive.start()
+
+    async def on_message(event, edited):
+        for archive in archives:
+            if archive.matches(event.chat_id, event.message):
+                try:
+                    await archive.add_message(event.message, edited)
+                except Exception as e:
+                    logger.error(f"Error processing live message {event.message.id} for {archive.label}: {e}")
+
+    async def on_new_message(event):
+        await on_message(event, edited=False)
+
+    async def on_message_edited(event):
+        await on_message(event, edited=True)
+
+    async def on_message_deleted(event):
+        # chat_id is None for deletions in small groups (IDs are unique per account there)
+        for archive in archives:
+            if event.chat_id is None or event.chat_id == archive.group_id:
+                archive.mark_deleted(event.deleted_ids)
+
+    handlers = [(on_new_message, events.NewMessage()),
+                (on_message_edited, events.MessageEdited()),
+                (on_message_deleted, events.MessageDeleted())]
+    for callback, event in handlers:
+        client.add_event_handler(callback, event)
+
+    print(f"👀 Following {len(archives)} archive(s) for new, edited and deleted messages. Press Ctrl-C to stop.")
+    try:
+        while True:
+            await asyncio.sleep(FOLLOW_FLUSH_INTERVAL)
+            for archive in archives:
+                written = archive.flush()
+                if written:
+                    print(f"📝 [{archive.label}] {written} live update(s) appended")
+    finally:
+        for callback, event in handlers:
+            client.remove_event_handler(callback, event)
+        for archive in archives:
+            await archive.close()
+        save_user_cache()
+        print("🛑 Follow mode stopped, archives compacted.")
 
 if __name__ == '__main__':
     # Call load_configuration() at the very beginning of the main execution block
@@ -555,24 +2305,155 @@ if __name__ == '__main__':
                         help=f"Target Group/Channel ID. Overrides config/env. (Default from config: {DEFAULT_GROUP_ID})")
     parser.add_argument("--topic_id", type=int, required=False, 
                         help=f"Specific Topic ID. Overrides config/env. (Default from config: {DEFAULT_TOPIC_ID})")
+    parser.add_argument("--targets", type=parse_target, nargs='+', metavar="GROUP_ID[:TOPIC_ID]",
+                        help="Several groups/topics to scrape concurrently over one connection. Overrides --group_id/--topic_id and the 'targets' list in config.")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help=f"Maximum number of targets scraped at the same time. (Default from config: {MAX_CONCURRENT_TARGETS})")
+    parser.add_argument("--media_workers", type=int, default=MEDIA_DOWNLOAD_WORKERS,
+                        help=f"Number of concurrent media downloads. (Default: {MEDIA_DOWNLOAD_WORKERS})")
+    parser.add_argument("--export", choices=['excel', 'csv', 'both', 'none'], default=TABULAR_EXPORT,
+                        help=f"Tabular export written after each run. (Default: {TABULAR_EXPORT})")
+    parser.add_argument("--export_min_new", type=int, default=EXPORT_MIN_NEW_MESSAGES,
+                        help="Skip the tabular export until at least this many new messages were fetched since the last one.")
+    parser.add_argument("--parquet", action='store_true',
+                        help="Also maintain a Parquet dataset partitioned by month (requires pyarrow). Only changed months are rewritten.")
+    parser.add_argument("--sqlite", action='store_true',
+                        help="Also keep an indexed SQLite copy of the archive (archive.sqlite) for fast filtering and full-text search in the viewer.")
+    parser.add_argument("--metrics_port", type=int, default=None,
+                        help="Serve live scraper metrics in the Prometheus text format on this port (/metrics).")
+    parser.add_argument("--metrics_host", default=METRICS_HOST,
+                        help=f"Address the metrics server listens on (default: {METRICS_HOST}, this machine only). Use 0.0.0.0 to expose it on every interface.")
+    parser.add_argument("--thumbnails", action='store_true',
+                        help="After each scrape, create small thumbnails of images and poster frames of videos (requires Pillow; posters need ffmpeg).")
+    parser.add_argument("--thumbnails_only", action='store_true',
+                        help="Only create the missing thumbnails of the existing archive(s), without connecting to Telegram.")
+    parser.add_argument("--split_topics", action='store_true',
+                        help="When scraping a whole group, also write the archive of every forum topic in the same pass (media is shared).")
+    parser.add_argument("--sessions", nargs='+', metavar="SESSION_NAME",
+                        help="Additional Telegram session names (other accounts with access to the target) to split each target's history download across. Overrides 'sessions' in config.")
+    parser.add_argument("--metadata_only", action='store_true',
+                        help="Scrape messages without downloading media. Media details are recorded, so --backfill_media can download them later.")
+    parser.add_argument("--backfill_media", action='store_true',
+                        help="Instead of scraping, download the media still missing from the existing archive(s).")
+    parser.add_argument("--media_order", choices=['smallest', 'newest', 'images_first'], default='smallest',
+                        help="Download order of --backfill_media. (Default: smallest)")
+    parser.add_argument("--media_budget_mb", type=float, default=None,
+                        help="Maximum megabytes downloaded by --backfill_media (files of unknown size are skipped).")
+    parser.add_argument("--sync_edits", action='store_true',
+                        help="Instead of scraping, re-check archived messages for edits and deletions and update them in place.")
+    parser.add_argument("--sync_window", type=int, default=SYNC_WINDOW_MESSAGES,
+                        help=f"Newest archived messages re-checked by --sync_edits. (Default: {SYNC_WINDOW_MESSAGES})")
+    parser.add_argument("--sync_sample", type=int, default=0,
+                        help=f"Additional random blocks of {SYNC_SAMPLE_BLOCK} older messages re-checked by --sync_edits. (Default: 0)")
+    parser.add_argument("--follow", action='store_true',
+                        help="After the regular run, keep running and append new, edited and deleted messages as they happen (Ctrl-C to stop).")
+    parser.add_argument("--export_only", action='store_true',
+                        help="Only write the tabular export of the existing archive(s), without connecting to Telegram.")
     
     args = parser.parse_args()
+    MEDIA_DOWNLOAD_WORKERS = args.media_workers
+    TABULAR_EXPORT = args.export
+    EXPORT_MIN_NEW_MESSAGES = args.export_min_new
+    PARQUET_EXPORT = args.parquet
+    SQLITE_INDEX = args.sqlite
+    SPLIT_TOPICS = args.split_topics
+    THUMBNAILS = args.thumbnails
+    if args.metadata_only:
+        DOWNLOAD_MEDIA = False
 
-    # Determine the final group_id and topic_id to use
-    # Priority: command-line arg > config/env default
-    target_group_id = args.group_id if args.group_id is not None else DEFAULT_GROUP_ID
-    target_topic_id = args.topic_id if args.topic_id is not None else DEFAULT_TOPIC_ID
+    # Determine the targets to scrape
+    # Priority: --targets > --group_id/--topic_id > 'targets' in config > config/env default group
+    if args.targets:
+        targets = args.targets
+    elif args.group_id is None and args.topic_id is None and TARGETS:
+        targets = TARGETS
+    else:
+        target_group_id = args.group_id if args.group_id is not None else DEFAULT_GROUP_ID
+        target_topic_id = args.topic_id if args.topic_id is not None else DEFAULT_TOPIC_ID
 
-    if target_group_id is None: # Should only happen if not set in config, env, or as arg, and no hardcoded default
-        print("❌ Error: Group ID is not specified. Provide --group_id, or set in config.json or TELEGRAM_DEFAULT_GROUP_ID env var.")
-        exit(1)
+        if target_group_id is None: # Should only happen if not set in config, env, or as arg, and no hardcoded default
+            print("❌ Error: Group ID is not specified. Provide --group_id, or set in config.json or TELEGRAM_DEFAULT_GROUP_ID env var.")
+            exit(1)
+        targets = [(target_group_id, target_topic_id)]
+    targets = list(dict.fromkeys(targets)) # The same archive must not be scraped twice at once
+
+    if args.export_only:
+        for group_id, topic_id in targets:
+            archive_dir = get_archive_dir(group_id, topic_id)
+            if not archive_store.archive_exists(archive_dir):
+                print(f"❌ No archive found in {archive_dir}")
+                continue
+            archive_store.compact_if_needed(archive_dir) # Drop superseded lines left by earlier runs
+            if SQLITE_INDEX or archive_store.sqlite_exists(archive_dir):
+                print(f"🗃️ SQLite index: {archive_store.build_sqlite_index(archive_dir)} messages")
+            export_tabular(archive_dir, 'excel' if TABULAR_EXPORT == 'none' else TABULAR_EXPORT)
+            parquet_written = PARQUET_EXPORT and export_parquet(archive_dir) is not None # Full rebuild
+            checkpoint = archive_store.load_checkpoint(archive_dir)
+            checkpoint['messages_since_export'] = 0
+            if parquet_written:
+                checkpoint['parquet_pending_months'] = []
+            archive_store.save_checkpoint(archive_dir, checkpoint)
+            update_catalog(archive_dir)
+        exit(0)
+
+    if args.thumbnails_only:
+        for group_id, topic_id in targets:
+            archive_dir = get_archive_dir(group_id, topic_id)
+            if not archive_store.archive_exists(archive_dir):
+                print(f"❌ No archive found in {archive_dir}")
+                continue
+            print(f"🖼️ {archive_dir}: {asyncio.run(generate_thumbnails(archive_dir))} thumbnail(s) created")
+            update_catalog(archive_dir, archive_store.compact_if_needed(archive_dir))
+        exit(0)
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port, args.metrics_host)
 
     # Initialize Telegram client (needs to be done after API_ID and API_HASH are loaded)
     client = TelegramClient('session_telegram', API_ID, API_HASH)
+    client.flood_sleep_threshold = 0 # Every FloodWaitError goes to the rate limiters instead of sleeping silently
+
+    # Additional sessions are connected (and signed in, the first time) by run_scraper()
+    if args.sessions:
+        SESSIONS = [{'name': name, 'phone': None} for name in args.sessions]
+    for session in SESSIONS:
+        if session['name'] == 'session_telegram':
+            continue # The main session
+        session_client = TelegramClient(session['name'], API_ID, API_HASH)
+        session_client.flood_sleep_threshold = 0
+        extra_sessions.append({**session, 'client': session_client})
 
     try:
         with client:
-            client.loop.run_until_complete(run_scraper(target_group_id, target_topic_id))
+            if args.backfill_media:
+                budget_bytes = int(args.media_budget_mb * 1024 * 1024) if args.media_budget_mb is not None else None
+                for group_id, topic_id in targets:
+                    client.loop.run_until_complete(backfill_media(group_id, topic_id, args.media_order, budget_bytes))
+            elif args.sync_edits:
+                for group_id, topic_id in targets:
+                    client.loop.run_until_complete(sync_edits(group_id, topic_id, args.sync_window, args.sync_sample))
+            elif len(targets) == 1:
+                client.loop.run_until_complete(run_scraper(*targets[0]))
+            else:
+                client.loop.run_until_complete(run_targets(targets, args.concurrency))
+            if args.follow:
+                follow_task = client.loop.create_task(follow_targets(targets))
+                try:
+                    # SIGTERM (e.g. from a service manager) stops following like Ctrl-C
+                    client.loop.add_signal_handler(signal.SIGTERM, follow_task.cancel)
+                except NotImplementedError: # Windows event loops do not support signal handlers
+                    pass
+                try:
+                    client.loop.run_until_complete(follow_task)
+                except asyncio.CancelledError:
+                    pass # Stopped by SIGTERM after follow_targets() flushed and compacted
+                except KeyboardInterrupt:
+                    # Let follow_targets() flush and compact before the client disconnects
+                    follow_task.cancel()
+                    client.loop.run_until_complete(asyncio.gather(follow_task, return_exceptions=True))
+            for session in extra_sessions:
+                if session['client'].is_connected():
+                    client.loop.run_until_complete(session['client'].disconnect())
     except Exception as e:
         logger.critical(f"An unexpected critical error occurred: {e}", exc_info=True)
         print(f"❌ A critical error occurred: {e}")